@@ -0,0 +1,156 @@
+import asyncio
+
+try:
+  import common.connect
+except ImportError as ie:
+  from sys import path
+  import os
+  path.append(os.path.abspath('.'))
+  path.append(os.path.abspath('..'))
+  import common.connect
+
+
+class AsyncMediaConnection:
+  """ The asyncio counterpart of MediaConnection. It wraps a blocking
+  connection (by default a new `connection_class`), keeping that
+  connection's request building, error handling and rate limiting:
+  waits are reserved from the same token buckets and AdaptiveThrottle,
+  and flag_wait() lockouts are shared, but they are awaited with
+  asyncio.sleep, so one rate-limited key does not stall the others.
+
+  The request itself still blocks (urllib and oauth2 have no
+  non-blocking interface), so it is made with asyncio.to_thread. A
+  semaphore keeps at most `concurrency` requests in flight for the
+  connection, so only requests actually on the wire hold a thread. """
+
+  connection_class = common.connect.MediaConnection
+
+  def __init__(self, *args, connection=None, concurrency=1, logger=None):
+    if connection is None:
+      connection = self.connection_class(*args, logger=logger)
+    self.connection = connection
+    self.logger = connection.logger
+    self.concurrency = concurrency
+    self.semaphore = asyncio.Semaphore(concurrency)
+    self.pacing = asyncio.Lock()
+    #Requests waiting for, or holding, a place under the semaphore.
+    self.inflight = 0
+
+  @property
+  def waitfrom(self):
+    return self.connection.waitfrom
+
+  def flag_wait(self):
+    self.connection.flag_wait()
+
+  async def wait(self, url=None):
+    """ Non-blocking equivalent of MediaConnection.wait(). """
+    while True:
+      seconds = self.connection.wait_time(url)
+      if self.connection.waitfrom:
+        self.logger.info("Waiting {:.0f} more seconds of {}".format(seconds, self.connection.waitseconds))
+      elif seconds > 0:
+        self.logger.info('Delay of {:.2f}'.format(seconds))
+      await asyncio.sleep(seconds)
+      if not self.connection.waitfrom:
+        break
+
+  async def get(self, url, params):
+    """ Query a resource using the given parameters, as
+    MediaConnection.get(). """
+    cached = self.connection.from_cache(url, params)
+    if cached is not None:
+      return cached
+    self.inflight += 1
+    try:
+      async with self.semaphore:
+        for attempt in range(self.connection.retries + 1):
+          #Requests are started in turn as the rate limit allows, but may overlap.
+          async with self.pacing:
+            await self.wait(url)
+          result = await asyncio.to_thread(self.connection.fetch, url, params)
+          if self.connection.laststatus not in self.connection.throttle_codes:
+            break
+          self.logger.info("Throttled requesting `{}`; attempt {} of {}.".format(url, attempt+1, self.connection.retries+1))
+        return result
+    finally:
+      self.inflight -= 1
+
+  def ready_in(self, url=None):
+    """ Estimate the seconds until a new request to `url` would go
+    ahead, allowing for those already queued here. """
+    bucket = self.connection.bucket(url)
+    interval = 1/bucket.rate if bucket else 0
+    return self.connection.ready_in(url) + interval * self.inflight / self.concurrency
+
+
+class AsyncJSONConnection(AsyncMediaConnection):
+
+  connection_class = common.connect.JSONConnection
+
+
+class AsyncOauthConnection(AsyncMediaConnection):
+  """ OAuth clients are not thread-safe, so these connections
+  only ever carry one request at a time. """
+
+  connection_class = common.connect.OauthConnection
+
+  def __init__(self, *args, connection=None, concurrency=1, logger=None):
+    super().__init__(*args, connection=connection, concurrency=1, logger=logger)
+
+
+class AsyncJSONOauthConnection(AsyncOauthConnection):
+
+  connection_class = common.connect.JSONOauthConnection
+
+
+class AsyncPooledConnection:
+  """ The asyncio counterpart of PooledConnection, sharing requests
+  between async wrappers of each connection in a pool. Keys are
+  chosen and quarantined as by the pool itself. """
+
+  def __init__(self, pool):
+    self.blocking = pool
+    self.pool = [wrap(con, pool.per_key) for con in pool.pool]
+    self.capacity = pool.capacity
+    self.turn = 0
+
+  def get_connection(self, exclude=(), url=None):
+    """ Prefer healthy connections which can go ahead soonest, then
+    those with the fewest requests in flight, taking turns. """
+    n = len(self.pool)
+    candidates = [i for i, con in enumerate(self.pool) if con not in exclude] or list(range(n))
+    healthy = [i for i in candidates if not self.blocking.is_quarantined(self.pool[i].connection)]
+    best = min(healthy or candidates, key=lambda i: (self.pool[i].ready_in(url), self.pool[i].inflight, (i - self.turn) % n))
+    self.turn = best + 1
+    return self.pool[best]
+
+  async def get(self, url, params):
+    cached = self.blocking.pool[0].from_cache(url, params)
+    if cached is not None:
+      return cached
+    tried = []
+    for attempt in range(self.blocking.retries):
+      connection = self.get_connection(exclude=tried, url=url)
+      autherrors = connection.connection.autherrors
+      result = await connection.get(url, params)
+      tried.append(connection)
+      if connection.connection.autherrors > autherrors:
+        self.blocking.quarantine(connection.connection)
+      elif not connection.waitfrom:
+        break
+      self.logger.info("Retrying `{}` with another key.".format(url))
+    return result
+
+  @property
+  def logger(self):
+    return self.blocking.logger
+
+
+def wrap(connection, concurrency=1):
+  """ Return an async wrapper around a blocking connection or pool. """
+  if isinstance(connection, common.connect.PooledConnection):
+    return AsyncPooledConnection(connection)
+  elif isinstance(connection, common.connect.OauthConnection):
+    return AsyncOauthConnection(connection=connection)
+  return AsyncMediaConnection(connection=connection, concurrency=concurrency)
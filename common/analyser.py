@@ -1,7 +1,8 @@
 import re
 import os
-import json
+import time
 import pickle
+import logging
 import datetime
 
 try:
@@ -13,6 +14,9 @@ except ImportError as ie:
   import common.logger
 
 import common.imagestore
+import common.imagefeatures
+import common.timeline
+import common.rawstore
 
 class Content:
   """ The Content object wraps varied user publications online, 
@@ -24,6 +28,9 @@ class Content:
   VIDEO = 2
   TEXT = 3
   LINKS = 4
+
+  pickle_version = 2
+  __slots__ = ('ctype', 'body', 'time', 'location', 'category', 'opinions')
   
   def __init__(self,ctype,body,time,location,category,opinions):
     """ Initialise a Content object.
@@ -41,6 +48,23 @@ class Content:
     self.category = category
     self.opinions = opinions
 
+  def __getstate__(self):
+    #Times are pickled as epoch seconds, rather than struct_times.
+    values = tuple(getattr(self, name) for name in Content.__slots__)
+    if isinstance(self.time, time.struct_time):
+      values = values[:2] + (common.timeline.seconds(self.time),) + values[3:]
+    return (Content.pickle_version, values)
+
+  def __setstate__(self, state):
+    if isinstance(state, dict):
+      #Pickled before Content had slots: the instance's __dict__.
+      state = (None, tuple(state.get(name) for name in Content.__slots__))
+    version, values = state
+    for name, value in zip(Content.__slots__, values):
+      setattr(self, name, value)
+    if version and version >= 2 and isinstance(self.time, int):
+      self.time = time.gmtime(self.time)
+
 
 
 class Location:
@@ -49,6 +73,9 @@ class Location:
     is to use a lon/lat tuple, which should be passed
     with a 'detailed' flag, the second is to use a
     string address. """
+
+  pickle_version = 1
+  __slots__ = ('location', 'detailed')
   
   def __init__(self, location, detailed=False):
       """ Create a Location object. 
@@ -58,6 +85,15 @@ class Location:
       self.detailed = detailed
       self.location = location
 
+  def __getstate__(self):
+      return (Location.pickle_version, self.location, self.detailed)
+
+  def __setstate__(self, state):
+      if isinstance(state, dict):
+          #Pickled before Location had slots: the instance's __dict__.
+          state = (None, state.get('location'), state.get('detailed', False))
+      version, self.location, self.detailed = state
+
   def near(self, otherlocation):
       """ See whether a Location is 'near' another Location.
       This only really works if both Location objects are 'detailed' (i.e. coordinates).
@@ -93,7 +129,109 @@ class Location:
 class Profile:
     """ A Profile reflects an image of a person on one particular network.
     Profile objects hold all the information which has been mined about
-    a target from a network. """
+    a target from a network.
+
+    Profiles keep their fields in slots, and most are left unset: list
+    fields are only created when first used, and other fields read as
+    their defaults. Pickles hold only the fields which have been given
+    values, and pickles of older Profiles can still be loaded. """
+
+    pickle_version = 1
+
+    #Fields holding lists, created empty when first used.
+    list_fields = (
+      #Contact Details
+      'web_links',          #Free URLs for a personal home page or similar.
+      'profile_links',      #URLs for other profiles of the same person.
+      'email_addresses',    #Email addresses for this profile.
+      'phone_numbers',      #Phone numbers for this profile.
+
+      #Biographical
+      'names',              #UIDs or usernames for this profile.
+      'self_descriptions',  #Self-descriptive texts.
+      'tags',               #Textual tags describing the person.
+      'education',          #Strings listing educational institutions, in order.
+      'relationship_status',#A person's marital or relationship status.
+      'sexual_orientation', #A person's reported orientation.
+      'habits',             #A list of habits the profile identifies its owner as having.
+
+      #Visual
+      'profile_images',     #Links to the main avatars of the profile. (Downloaded?)
+      'banners',            #Links to the personal header or background images.
+      'tagged_photos',      #Images linked to this profile by this or other users.
+
+      #Opinion
+      'content_opinion',    #Opinion ratings of in-network user content, {link:opinion}
+      'brand_opinion',      #Opinion ratings of in-network brand/corporate content.
+      'other_opinion',      #Opinion ratings of off-network content.
+
+      #Geographical
+      'location_set',       #Set of all locations associated with the profile.
+
+      #Degree
+      'trophies',           #Custom award tags this user has unlocked.
+
+      #Relationships
+      'interacted',         #Links to profiles interacted with.
+      'followers',          #Links to profiles of followers.
+      'followed_by',        #Links to profiles which this user follows.
+      'grouped',            #Links to profiles this user is grouped with.
+
+      'brands_followed',    #Links to profiles of brands this user follows.
+      'contributor',        #Links to profiles of brands this user contributes to.
+
+      'content',            #List of content items
+    )
+
+    #Other fields, and their values until set.
+    defaults = {
+      #Cached results of the comparison helpers.
+      'tactprofile': None,
+      'histogram': None,
+      'image_hash': None,
+      'writing_style': None,
+      'primary_name': None,
+      'name_length': 0,
+      'linklist': None,
+      'rid': None,                 #The profile's record uid, set by the resolver.
+
+      #Biographical
+      'age': 0,                    #Person's reported age.
+      'occupation': None,          #Current occupation.
+      'gender': None,              #The reported gender.
+      'verified': False,           #Whether the network has vetted this profile for accuracy.
+      'religion': None,            #The described religion.
+      'physical': None,            #A physical description of the person holding the profile.
+
+      #Temporal
+      'membership_date': None,     #Date/time the user joined the network (estimated from timestamps if possible)
+      'last_seen': None,           #Date/time the user was last seen by the network (estimated if necessary/possible).
+
+      #Geographical
+      'current_location': None,    #Current lat/long
+
+      #Degree
+      'subscribers': 0,            #Number of people following this profile.
+      'subscribed': 0,             #Number of people this user follows.
+      'contributions': 0,          #Number of contribution made to the network.
+      'visibility': 0,             #Number of views of this profile.
+      'reputation': None,          #This user's reputation as rated by others.
+      'rank': None,                #This user's rank in the community, as expressed in tiered levels.
+    }
+
+    #The times (and places) of activities are kept in `timeline`, a
+    #common.timeline.Timeline; `activity_timestamps` and `location_history`
+    #present them as the lists of struct_times and {time:location}
+    #dicts they once were.
+    __slots__ = ('uid', 'network', 'source', 'collected_at', 'timeline') + list_fields + tuple(defaults)
+
+    @property
+    def activity_timestamps(self):
+      return common.timeline.ActivityTimes(self.timeline)
+
+    @property
+    def location_history(self):
+      return common.timeline.LocationHistory(self.timeline)
 
     def __eq__(self,other):
       return self.uid == other.uid
@@ -129,21 +267,47 @@ class Profile:
     
       :return: A histogram as generated by Image.histogram()."""
       if not self.histogram:
-        from PIL import Image
-        size = (128,128)
         if len(self.profile_images) > 0:
           imgfile = self.profile_images[0]
-          if imgfile:
+          #An image which could not be downloaded never appears on disk.
+          if imgfile and os.path.exists(imgfile):
+            features = common.imagefeatures.lookup(imgfile)
+            if features:
+              #Computed when the image was saved; no need to decode it.
+              self.histogram = features['histogram']
+              return self.histogram
             try:
-              image = Image.open(imgfile)
-              image.thumbnail(size, Image.ANTIALIAS)
-              self.histogram = image.histogram()
+              with open(imgfile, 'rb') as fh:
+                self.histogram = common.imagefeatures.describe(fh.read())['histogram']
             except Exception as e:
               logging.warn(e)
               return None
       return self.histogram
 
 
+    def getImageHash(self):
+      """ Returns the perceptual hash (dHash) of the
+      primary profile image associated with this
+      profile.
+
+      :return: A 64-bit integer, or None if there is no image."""
+      if self.image_hash is None:
+        if len(self.profile_images) > 0:
+          imgfile = self.profile_images[0]
+          #An image which could not be downloaded never appears on disk.
+          if imgfile and os.path.exists(imgfile):
+            features = common.imagefeatures.lookup(imgfile)
+            if not features:
+              try:
+                with open(imgfile, 'rb') as fh:
+                  features = common.imagefeatures.describe(fh.read())
+              except Exception as e:
+                logging.warn(e)
+                return None
+            self.image_hash = features['dhash']
+      return self.image_hash
+
+
     def getWritingStyle(self):
       """ Generate a signature for a series of texts,
           being the proportion of normalised function
@@ -182,26 +346,13 @@ class Profile:
         :return: A dict with activity periods (index into above set of ranges) keys and normalised frequency values.
         """
         if not self.tactprofile:
-          times = self.activity_timestamps
-          if len(times) == 0:
+          counts = self.timeline.hour_histogram(4)
+          total = sum(counts)
+          if total == 0:
                return None
           tactprofile = {}
-          unit = 1/len(times)
-          for i in range(0,6,1):
-              tactprofile[i] = 0
-          for t in times:
-              if t.tm_hour < 4:
-                  tactprofile[0] += unit
-              elif t.tm_hour > 3 and t.tm_hour < 8:
-                  tactprofile[1] += unit
-              elif t.tm_hour > 7 and t.tm_hour < 12:
-                  tactprofile[2] += unit
-              elif t.tm_hour > 11 and t.tm_hour < 16:
-                  tactprofile[3] += unit
-              elif t.tm_hour > 15 and t.tm_hour < 20:
-                  tactprofile[4] += unit
-              elif t.tm_hour > 19:
-                  tactprofile[5] += unit
+          for i, count in enumerate(counts):
+              tactprofile[i] = count/total
           self.tactprofile = tactprofile
         return self.tactprofile
 
@@ -230,78 +381,56 @@ class Profile:
       :param str source: A string containing the full URL for the profile's source. 
       :param datetime dated: A datetime object indicating when the profile was collected (defaults to `now`). """ 
       self.uid = id
-      self.tactprofile = None
-      self.histogram = None
-      self.writing_style = None
-      self.primary_name = None
-      self.name_length = 0
-      self.linklist = None
       self.network = network
       self.source = source
       if dated == None:
         self.collected_at = datetime.datetime.now()
       else:
         self.collected_at = dated
-      #Contact Details
-      self.web_links = []        #Free URLs for a personal home page or similar.
-      self.profile_links = []    #URLs for other profiles of the same person.
-      self.email_addresses = []  #Email addresses for this profile.
-      self.phone_numbers = []    #Phone numbers for this profile.
-
-      #Biographical
-      self.names = []        #UIDs or usernames for this profile.
-      self.self_descriptions = []#Self-descriptive texts.
-      self.age = 0               #Person's reported age.
-      self.tags = []             #Textual tags describing the person.
-      self.education = []        #Strings listing educational institutions, in order.
-      self.occupation = None       #Current occupation.
-      self.gender = None           #The reported gender.
-      self.relationship_status = []#A person's marital or relationship status.
-      self.sexual_orientation = []#A person's reported orientation.
-      self.verified = False      #Whether the network has vetted this profile for accuracy.
-      self.religion = None         #The described religion.
-      self.physical = None       #A physical description of the person holding the profile.
-      self.habits = []           #A list of habits the profile identifies its owner as having.
-
-      #Visual
-      self.profile_images = []   #Links to the main avatars of the profile. (Downloaded?)
-      self.banners = []          #Links to the personal header or background images.
-      self.tagged_photos = []    #Images linked to this profile by this or other users.
-
-      #Opinion
-      self.content_opinion = []  #Opinion ratings of in-network user content, {link:opinion}
-      self.brand_opinion = []    #Opinion ratings of in-network brand/corporate content.
-      self.other_opinion = []    #Opinion ratings of off-network content.
-      
-      #Temporal
-      self.activity_timestamps = []#list of activity times.
-      self.membership_date = None  #Date/time the user joined the network (estimated from timestamps if possible)
-      self.last_seen = None        #Date/time the user was last seen by the network (estimated if necessary/possible).
-
-      #Geographical
-      self.current_location = None #Current lat/long
-      self.location_set = []       #Set of all locations associated with the profile.
-      self.location_history = []   #{location:time} for each location (generates location_set as well).
-
-      #Degree
-      self.subscribers = 0         #Number of people following this profile.
-      self.subscribed = 0          #Number of people this user follows.
-      self.contributions = 0       #Number of contribution made to the network.
-      self.visibility = 0          #Number of views of this profile.
-      self.reputation = None       #This user's reputation as rated by others.
-      self.trophies = []           #Custom award tags this user has unlocked.
-      self.rank = None             #This user's rank in the community, as expressed in tiered levels.
-
-      #Relationships
-      self.interacted = []         #Links to profiles interacted with.
-      self.followers = []          #Links to profiles of followers.
-      self.followed_by = []        #Links to profiles which this user follows.
-      self.grouped = []            #Links to profiles this user is grouped with.
-
-      self.brands_followed = []    #Links to profiles of brands this user follows.
-      self.contributor = []        #Links to profiles of brands this user contributes to.
-
-      self.content = []            #List of content items
+      #Every other field reads as its default (or an empty list) until set.
+
+    def __getattr__(self, name):
+      #Only called for fields which have not been set.
+      if name in Profile.list_fields or name == 'timeline':
+        value = [] if name != 'timeline' else common.timeline.Timeline()
+        setattr(self, name, value)
+        return value
+      if name in Profile.defaults:
+        return Profile.defaults[name]
+      raise AttributeError("'Profile' object has no attribute '{}'".format(name))
+
+    def __getstate__(self):
+      """ Pickle only the fields which differ from their defaults. """
+      fields = {}
+      for name in Profile.__slots__:
+        try:
+          value = object.__getattribute__(self, name)
+        except AttributeError:
+          continue
+        if name in Profile.list_fields or name == 'timeline':
+          if not value:
+            continue
+        elif name in Profile.defaults:
+          default = Profile.defaults[name]
+          if value is default or (type(value) is type(default) and value == default):
+            continue
+        fields[name] = value
+      return (Profile.pickle_version, fields)
+
+    def __setstate__(self, state):
+      if isinstance(state, dict):
+        #Pickled before Profiles had slots: the instance's __dict__.
+        fields = state
+      else:
+        version, fields = state
+      for name, value in fields.items():
+        if name in Profile.__slots__:
+          setattr(self, name, value)
+      #Older pickles have lists of times and {time:location} dicts.
+      for t in fields.get('activity_timestamps', ()):
+        self.activity_timestamps.append(t)
+      for entry in fields.get('location_history', ()):
+        self.location_history.append(entry)
 
 
 def my_import(name):
@@ -359,37 +488,71 @@ class Analyser:
   def store(self, profile, filepath):
     pickle.dump(profile, open(filepath,'wb'))
 
-  def run(self,indirpath='raw',outdirpath='profiles'):
+  def analyse_record(self, response_obj, record, outdirpath):
+    """ Analyse the responses downloaded for a record, and store the
+    resulting Profile in `outdirpath`. Does not touch the ProfileStore,
+    so can be run in a worker process (see common.analysisdriver).
+
+    :return: The Profile's best name, and records for the profiles it links to. """
+    profile = self.analyse(response_obj,record)
+    self.store(profile, outdirpath+os.sep+str(record['uid'])+'.pickle')
+    links = []
+    for link in profile.profile_links:
+      rec = self.url_to_record(link, profile.bestname())
+      if rec:
+        links.append(rec)
+      else:
+        self.logger.info("Link {} failed to translate into a record.".format(link))
+    return profile.bestname(), links
+
+  def add_links(self, uid, links):
+    """ Mark a record as analysed, adding the records its profile links
+    to, and matches to them, to the ProfileStore. """
+    with self.profilestore.locked():
+      self.profilestore.mark_done(uid, 'analysed')
+      for rec in links:
+        lid = self.profilestore.add_record(rec)
+        self.profilestore.add_match(uid, lid)
+
+  def run(self,indirpath='raw',outdirpath='profiles',redo=False):
+    """ Analyse the downloaded records for this network which have
+    not been analysed already (or all of them, if `redo` is set). """
 
     if not os.path.exists(outdirpath):
       os.makedirs(outdirpath)
 
     names = set()
+    rawstore = common.rawstore.RawStore(indirpath, self.logger)
+
+    if redo:
+      records = list(self.profilestore.by_network(self.network_name))
+    else:
+      records = self.profilestore.pending('analysed', self.network_name)
 
-    for record in self.profilestore.records:
-      fname = str(record['uid'])+'.json'
+    for record in records:
+      response_obj = rawstore.get(record['uid'])
 
-      if record['network'] == self.network_name and os.path.exists(indirpath+os.sep+fname):
-        self.logger.info("Analysing {}".format(fname))
-        response_obj = json.load(open(indirpath+os.sep+fname,'r'))
-        profile = self.analyse(response_obj,record)
+      if response_obj is not None:
+        self.logger.info("Analysing {}".format(record['uid']))
+        name, links = self.analyse_record(response_obj, record, outdirpath)
 
         if self.namesfh:
           #If we're building a name-list (G+ only, usually), add it here.
-          names.add(profile.bestname())
+          names.add(name)
+
+        self.add_links(record['uid'], links)
 
-        self.store(profile, outdirpath+os.sep+str(record['uid'])+'.pickle')
+    #Images are downloaded in the background; wait for the stragglers.
+    for url in self.imagestore.drain():
+      self.logger.info("Image {} could not be saved.".format(url))
 
-        for link in profile.profile_links:
-          rec = self.url_to_record(link, profile.bestname())
-          if rec:
-            lid = self.profilestore.add_record(rec)
-            self.profilestore.add_match(record['uid'], lid)
-          else:
-            self.logger.info("Link {} failed to translate into a record.".format(link))
+    self.write_names(names)
 
+  def write_names(self, names):
+    """ Add names to the name-list, if one is being built. """
     if self.namesfh:
     #Write names file. 
       for name in names:
         if name:
           self.namesfh.write(name+'\n')
+      self.namesfh.flush()
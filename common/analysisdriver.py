@@ -0,0 +1,133 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+  import common.logger
+except ImportError as ie:
+  from sys import path
+  path.append(os.path.abspath('.'))
+  path.append(os.path.abspath('..'))
+  import common.logger
+
+import common.rawstore
+
+
+#The analysers and stores of a worker process, set up by _init_worker().
+_worker = {}
+
+
+def _init_worker(classes, indirpath, outdirpath, loggername):
+  #The parent's logger, as configured there; getLogger() would reset its level.
+  logger = logging.getLogger(loggername)
+  _worker['analysers'] = dict((cls.network_name, cls(None, logger)) for cls in classes)
+  _worker['rawstore'] = common.rawstore.RawStore(indirpath, logger)
+  _worker['outdirpath'] = outdirpath
+  _worker['logger'] = logger
+
+
+def _analyse_batch(records):
+  """ Analyse a batch of records in a worker, storing their Profiles.
+
+  :return: A list of (uid, network, best name, linked records) for each
+           record analysed, a list of (uid, error) for each record which
+           could not be, and a list of images which failed to save. """
+  results = []
+  errors = []
+  for record in records:
+    try:
+      response_obj = _worker['rawstore'].get(record['uid'])
+      if response_obj is not None:
+        _worker['logger'].info("Analysing {}".format(record['uid']))
+        analyser = _worker['analysers'][record['network']]
+        name, links = analyser.analyse_record(response_obj, record, _worker['outdirpath'])
+        results.append((record['uid'], record['network'], name, links))
+    except Exception as e:
+      _worker['logger'].exception("Could not analyse {}".format(record['uid']))
+      errors.append((record['uid'], repr(e)))
+  failed = []
+  for analyser in _worker['analysers'].values():
+    failed.extend(analyser.imagestore.drain())
+  return results, errors, failed
+
+
+class AnalysisDriver:
+  """ Analyses the downloaded records of several networks at once.
+
+  The records waiting for analysis are found in one pass over the
+  ProfileStore, and sent in batches to a pool of worker processes,
+  each with its own instance of every network's Analyser. The workers
+  parse the responses and store the Profiles; the new records and
+  matches from each batch's profile links are sent back and added to
+  the store by this process, the only one writing to it. """
+
+  batch_size = 32
+
+  def __init__(self, profilestore, analysers, logger=None, workers=None):
+    """ :param ProfileStore profilestore: The store of records to analyse.
+    :param list analysers: An Analyser for each network to analyse.
+    :param int workers: The number of worker processes (default: one per CPU). """
+    if not logger:
+      logger = common.logger.getLogger(self.__class__.__name__)
+    self.logger = logger
+    self.profilestore = profilestore
+    self.analysers = dict((analyser.network_name, analyser) for analyser in analysers)
+    self.workers = workers or os.cpu_count() or 1
+
+  def run(self, indirpath='raw', outdirpath='profiles', redo=False):
+    """ Analyse the downloaded records of every network which have not
+    been analysed already (or all of them, if `redo` is set). A record
+    which fails is logged and left unanalysed, without stopping the rest.
+
+    :return: The uids of the records which could not be analysed. """
+    if not os.path.exists(outdirpath):
+      os.makedirs(outdirpath)
+
+    if redo:
+      records = [r for network in self.analysers for r in self.profilestore.by_network(network)]
+    else:
+      records = [r for r in self.profilestore.pending('analysed') if r['network'] in self.analysers]
+    rawstore = common.rawstore.RawStore(indirpath, self.logger)
+    records = [dict(r.items()) for r in records if r['uid'] in rawstore]
+    batches = [records[i:i+self.batch_size] for i in range(0, len(records), self.batch_size)]
+    self.logger.info("Analysing {} records with {} workers.".format(len(records), self.workers))
+
+    names = dict((network, set()) for network in self.analysers)
+    unanalysed = []
+    initargs = ([type(a) for a in self.analysers.values()], indirpath, outdirpath, self.logger.name)
+    if self.workers == 1:
+      _init_worker(*initargs)
+      for batch in batches:
+        self._add_results(*_analyse_batch(batch), names=names, unanalysed=unanalysed)
+    else:
+      #Forked, so that scripts without a __main__ guard are not re-run.
+      context = multiprocessing.get_context('fork')
+      with ProcessPoolExecutor(self.workers, context, _init_worker, initargs) as executor:
+        futures = dict((executor.submit(_analyse_batch, batch), batch) for batch in batches)
+        for future in as_completed(futures):
+          try:
+            outcome = future.result()
+          except Exception as e:
+            #The worker itself failed (e.g. it was killed).
+            self.logger.error("A batch of {} records failed: {!r}".format(len(futures[future]), e))
+            unanalysed.extend(record['uid'] for record in futures[future])
+            continue
+          self._add_results(*outcome, names=names, unanalysed=unanalysed)
+
+    for network, analyser in self.analysers.items():
+      analyser.write_names(names[network])
+    if unanalysed:
+      self.logger.warn("{} records could not be analysed.".format(len(unanalysed)))
+    return unanalysed
+
+  def _add_results(self, results, errors, failed, names, unanalysed):
+    """ Add the outcome of a batch of analyses to the store. """
+    with self.profilestore.locked():
+      for uid, network, name, links in results:
+        self.analysers[network].add_links(uid, links)
+        names[network].add(name)
+    #Each has been logged, with its traceback, by the worker.
+    unanalysed.extend(uid for uid, error in errors)
+    for url in failed:
+      self.logger.info("Image {} could not be saved.".format(url))
@@ -0,0 +1,61 @@
+def hamming(a, b):
+  """ Return the number of bits which differ between two integers. """
+  return bin(a ^ b).count('1')
+
+
+class BKTree:
+  """ A Burkhard-Keller tree of integer hashes under Hamming distance,
+  for finding every hash within some distance of another without
+  comparing against them all. Each node's children are keyed by their
+  distance from it, and the triangle inequality rules out whole
+  subtrees during a search.
+
+  Each hash may carry any number of items (e.g. the profiles with that
+  avatar). """
+
+  def __init__(self, items=()):
+    """ :param items: An iterable of (hash, item) pairs to add. """
+    self.root = None
+    self.size = 0
+    for value, item in items:
+      self.add(value, item)
+
+  def __len__(self):
+    return self.size
+
+  def add(self, value, item=None):
+    """ Add an item under an integer hash. """
+    self.size += 1
+    if self.root is None:
+      self.root = (value, [item], {})
+      return
+    node = self.root
+    while True:
+      distance = hamming(value, node[0])
+      if distance == 0:
+        node[1].append(item)
+        return
+      child = node[2].get(distance)
+      if child is None:
+        node[2][distance] = (value, [item], {})
+        return
+      node = child
+
+  def search(self, value, radius):
+    """ Find the items whose hashes are within `radius` bits of `value`.
+
+    :return: A list of (distance, hash, item) tuples, nearest first. """
+    found = []
+    if self.root is None:
+      return found
+    stack = [self.root]
+    while stack:
+      node = stack.pop()
+      distance = hamming(value, node[0])
+      if distance <= radius:
+        found.extend((distance, node[0], item) for item in node[1])
+      for d, child in node[2].items():
+        if distance - radius <= d <= distance + radius:
+          stack.append(child)
+    found.sort(key=lambda f: f[0])
+    return found
@@ -0,0 +1,135 @@
+import io
+import json
+import threading
+from urllib.error import HTTPError
+from urllib.parse import urlsplit, parse_qsl
+
+try:
+  import common.responsecache
+except ImportError as ie:
+  from sys import path
+  import os
+  path.append(os.path.abspath('.'))
+  path.append(os.path.abspath('..'))
+  import common.responsecache
+import common.httppool
+
+
+class RecordedResponse(dict):
+  """ Response headers replayed for an OAuth client request, standing
+  in for the httplib2 response object. """
+
+  def __init__(self, status, reason, headers):
+    super().__init__(headers)
+    self.status = status
+    self.reason = reason
+
+
+class Cassette:
+  """ Records API responses to a JSON-lines file, and replays them.
+
+  Responses are keyed by the path and parameters of the request, with
+  credentials removed, so a cassette recorded against the live APIs
+  with one set of keys can be replayed with any other, or served by
+  common.fakeserver. Repeated requests replay their recorded responses
+  in order, the last one repeating.
+
+  In 'record' mode every request is made and recorded; in 'replay'
+  mode requests are only ever answered from the cassette (with a 404
+  where nothing was recorded); and in 'auto' mode recorded requests
+  are replayed and the rest made and recorded. """
+
+  modes = ['record', 'replay', 'auto']
+
+  def __init__(self, filename, mode='auto', logger=None):
+    if mode not in self.modes:
+      raise ValueError("Cassette mode must be one of {}".format(self.modes))
+    self.filename = filename
+    self.mode = mode
+    self.logger = logger
+    self.lock = threading.Lock()
+    self.interactions = {}
+    self.played = {}
+    try:
+      with open(filename, 'r', encoding='utf-8') as fh:
+        for line in fh:
+          if line.endswith('\n'):
+            interaction = json.loads(line)
+            self.interactions.setdefault(interaction['key'], []).append(interaction)
+    except FileNotFoundError:
+      pass
+
+  @staticmethod
+  def key(url):
+    """ Return the key under which responses to a url are recorded. """
+    parts = urlsplit(url)
+    return common.responsecache.ResponseCache.key(parts.path, dict(parse_qsl(parts.query)))
+
+  def lookup(self, url):
+    """ Return the next recorded interaction for a url, or None. """
+    key = self.key(url)
+    with self.lock:
+      recorded = self.interactions.get(key)
+      if not recorded:
+        return None
+      i = self.played.get(key, 0)
+      self.played[key] = i + 1
+      return recorded[min(i, len(recorded) - 1)]
+
+  def record(self, url, status, reason, headers, body):
+    parts = urlsplit(url)
+    interaction = {'key': self.key(url),
+                   'path': parts.path,
+                   'params': dict((k, v) for k, v in parse_qsl(parts.query)
+                                  if k not in common.responsecache.ResponseCache.credential_params
+                                  and not any(k.startswith(p) for p in common.responsecache.ResponseCache.credential_prefixes)),
+                   'status': status,
+                   'reason': reason,
+                   'headers': dict((k.lower(), v) for k, v in headers.items()),
+                   'body': body.decode('utf-8', 'replace')}
+    with self.lock:
+      if self.mode != 'record':
+        self.interactions.setdefault(interaction['key'], []).append(interaction)
+      with open(self.filename, 'a', encoding='utf-8') as fh:
+        fh.write(json.dumps(interaction)+'\n')
+
+  def _replay(self, url):
+    if self.mode == 'record':
+      return None
+    interaction = self.lookup(url)
+    if interaction is None and self.mode == 'replay':
+      if self.logger:
+        self.logger.warn("No recorded response for `{}`".format(url))
+      interaction = {'status': 404, 'reason': 'Not Recorded', 'headers': {}, 'body': ''}
+    return interaction
+
+  def urlopen(self, req, timeout=None):
+    """ common.httppool.urlopen(), through the cassette. """
+    url = req if isinstance(req, str) else req.full_url
+    interaction = self._replay(url)
+    if interaction is None:
+      try:
+        response = common.httppool.urlopen(req, timeout)
+        body = response.read()
+        self.record(url, response.status, response.reason, response.headers, body)
+      except HTTPError as e:
+        body = e.read()
+        self.record(url, e.code, e.reason, e.headers or {}, body)
+        raise HTTPError(url, e.code, e.reason, e.headers, io.BytesIO(body))
+      return common.httppool.Response(url, response.status, response.reason, response.headers, body)
+    body = interaction['body'].encode('utf-8')
+    if interaction['status'] >= 400:
+      raise HTTPError(url, interaction['status'], interaction['reason'], interaction['headers'], io.BytesIO(body))
+    return common.httppool.Response(url, interaction['status'], interaction['reason'], interaction['headers'], body)
+
+  def request(self, client, url, method='GET'):
+    """ An OAuth client's request(), through the cassette. """
+    interaction = self._replay(url)
+    if interaction is None:
+      resp, content = client.request(url, method)
+      status = int(resp.status) if hasattr(resp, 'status') else int(resp.get('status', 200))
+      self.record(url, status, getattr(resp, 'reason', ''), resp, content)
+      return resp, content
+    resp = RecordedResponse(interaction['status'], interaction['reason'], interaction['headers'])
+    resp['status'] = str(interaction['status'])
+    return resp, interaction['body'].encode('utf-8')
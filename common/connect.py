@@ -1,9 +1,11 @@
 from urllib.parse import urlencode
-from urllib.request import urlopen, Request
+from urllib.request import Request
 import json
 import oauth2 as oauth
 import datetime
 import time
+import random
+import threading
 
 try:
   import common.logger
@@ -13,6 +15,80 @@ except ImportError as ie:
   path.append(os.path.abspath('.'))
   path.append(os.path.abspath('..'))
   import common.logger
+import common.ratelimit
+from common.httppool import urlopen
+
+
+class AdaptiveThrottle:
+  """ Adapts the request rate to a network's pushback, by additive
+  increase and multiplicative decrease (AIMD). Each throttling
+  response halves the rate and pauses the network for a jittered,
+  exponentially growing backoff period. Each success adds back a
+  little rate. While the network is paused, requests to other
+  networks carry on.
+
+  A rate of None means requests are not limited by the throttle. """
+
+  increase = 0.05       #Requests per second added for each success.
+  decrease = 0.5        #Factor applied to the rate when throttled.
+  initial_rate = 1.0    #Rate to halve from, when there was no limit.
+  unlimited_rate = 10.0 #Rate above which the limit is lifted again.
+  min_rate = 1/600
+
+  def __init__(self, max_rate=None, backoff=5, max_backoff=3600, logger=None):
+    self.max_rate = max_rate
+    self.rate = max_rate
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.logger = logger
+    self.failures = 0
+    self.paused_until = 0
+    self.next_slot = 0
+    self.lock = threading.Lock()
+
+  def success(self):
+    with self.lock:
+      self.failures = 0
+      if self.rate is None:
+        return
+      self.rate += self.increase
+      if self.max_rate is not None and self.rate >= self.max_rate:
+        self.rate = self.max_rate
+      elif self.max_rate is None and self.rate >= self.unlimited_rate:
+        self.rate = None
+
+  def throttled(self):
+    """ Slow down after a throttling response, and pause. """
+    with self.lock:
+      if self.paused_until > time.monotonic():
+        #A reply to a request sent before the pause; already handled.
+        return
+      self.failures += 1
+      self.rate = max(self.min_rate, (self.rate or self.initial_rate) * self.decrease)
+      backoff = min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+      backoff *= random.uniform(0.5, 1.5)
+    if self.logger:
+      self.logger.warn("Throttled; pausing for {:.0f} seconds, then {:.3f} requests per second.".format(backoff, self.rate))
+    self.pause(backoff)
+
+  def pause(self, seconds):
+    """ Hold all requests through this throttle for `seconds`. """
+    with self.lock:
+      self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+  def ready_in(self):
+    """ Return the seconds until a request could go ahead. """
+    with self.lock:
+      return max(0, self.paused_until - time.monotonic(), self.next_slot - time.monotonic())
+
+  def reserve(self):
+    """ Reserve the next request slot, returning the seconds to wait for it. """
+    with self.lock:
+      now = time.monotonic()
+      start = max(now, self.paused_until, self.next_slot)
+      if self.rate is not None:
+        self.next_slot = start + 1/self.rate
+      return start - now
 
 
 class MediaConnection:
@@ -21,11 +97,39 @@ class MediaConnection:
   waitseconds = 0
   timeout = 5
   delay = 0
+  #A common.responsecache.ResponseCache shared by connections, if set.
+  cache = None
+  #A common.cassette.Cassette recording or replaying responses, if set.
+  cassette = None
+  #Replacement scheme://host prefixes for API urls, e.g. to send
+  #requests to a common.fakeserver instead.
+  hosts = {}
+  #Known quotas per endpoint family, as {url pattern: (requests, seconds)}.
+  #Other endpoints are limited to one request per `delay` seconds.
+  quotas = {}
+  #HTTP statuses meaning the credentials themselves were refused.
+  auth_error_codes = (401,)
+  #HTTP statuses meaning the network wants requests slowed down, and
+  #how many times get() should retry after one.
+  throttle_codes = (429,)
+  retries = 0
+  #Bounds of the throttle's backoff, in seconds.
+  backoff = 5
+  max_backoff = 3600
+  #The AdaptiveThrottle of each connection class, shared by its instances.
+  throttles = {}
+  throttlelock = threading.Lock()
 
   def __init__(self,logger=None):
     if not logger:
       logger = common.logger.getLogger(self.__class__.__name__)
     self.logger = logger
+    self.buckets = {}
+    self.bucketlock = threading.Lock()
+    self.requests = 0
+    self.errors = 0
+    self.autherrors = 0
+    self.laststatus = None
 
   def build_request(self,url,params):
     """ Apply any special preprocessing to the input
@@ -40,19 +144,32 @@ class MediaConnection:
 
   def handle_error(self, error_obj):
     self.logger.warn(error_obj)
-    if hasattr(error_obj, "code"):
+    body = self.error_body(error_obj)
+    if body:
+      self.logger.warn(body)
+
+
+  def error_body(self, error_obj):
+    """ Return the text of an HTTP error's response, or None. The
+    response can only be read once, so the text is kept on the error
+    for subclasses' handle_error(). """
+    if not hasattr(error_obj, "code"):
+      return None
+    if not hasattr(error_obj, "body_text"):
       try:
-        self.logger.warn(error_obj.read())
+        error_obj.body_text = error_obj.read().decode('utf-8', 'replace')
       except:
-        pass
+        error_obj.body_text = None
+    return error_obj.body_text
 
 
-  def handle_response(self,response_text):
+  def handle_response(self,response_text,headers=None):
     """ Handle the result of the request.
     This could mean parsing the response for error codes
     or doing some necessary post-processing.
     
-    :param dict response_text: The text of the requested resource, or None."""
+    :param dict response_text: The text of the requested resource, or None.
+    :param dict headers: The response headers, where available."""
     return response_text
   
 
@@ -62,55 +179,195 @@ class MediaConnection:
     self.waitfrom = datetime.datetime.now()
 
 
-  def wait(self):
-    """ Wait for a defined period. Usually will wait
-    for self.delay seconds (inter-request rate limiting), 
-    but will handle waiting periods when flag_wait has 
-    been called. """
-    if not self.waitfrom:
-      self.logger.info('Delay of {}'.format(self.delay))
-      time.sleep(self.delay)
-    else:
-      iterc = 0
-      while True:
-        iterc += 1
-        now = datetime.datetime.now()
-        diff = now - self.waitfrom
-        #timedelta shifts whole days into a different attribute, so we have to get them out again
-        daysecs = diff.days * 3600 * 24
-        if diff.seconds + daysecs >= self.waitseconds:
-          self.waitfrom = None
+  def bucket(self, url=None):
+    """ Return the TokenBucket limiting requests to the endpoint family
+    of `url` with this connection's credentials, or None if requests
+    to it are not limited. """
+    family = None
+    if url:
+      for pattern in self.quotas:
+        if pattern in url:
+          family = pattern
           break
+    with self.bucketlock:
+      if family not in self.buckets:
+        if family is not None:
+          self.buckets[family] = common.ratelimit.TokenBucket.from_quota(*self.quotas[family])
+        elif self.delay > 0:
+          self.buckets[family] = common.ratelimit.TokenBucket(1/self.delay)
         else:
-          decile = self.waitseconds/10
-          self.logger.info("{}) Have slept {} seconds of {}".format(iterc, diff.seconds, self.waitseconds))
-          time.sleep(decile)
+          self.buckets[family] = None
+      return self.buckets[family]
+
+
+  def update_limits(self, url, headers):
+    """ Update the rate limit for `url` from the rate-limit headers
+    of a response to it, where the API sends them. """
+    if not headers:
+      return
+    remaining = headers.get('x-rate-limit-remaining')
+    bucket = self.bucket(url)
+    if remaining is None or bucket is None:
+      return
+    try:
+      reset = headers.get('x-rate-limit-reset')
+      bucket.update(int(remaining), float(reset) if reset else None)
+    except ValueError:
+      pass
+
+
+  @property
+  def throttle(self):
+    """ The AdaptiveThrottle for this network. """
+    with MediaConnection.throttlelock:
+      cls = self.__class__
+      if cls not in MediaConnection.throttles:
+        #Per-key pacing is left to the token buckets; the throttle only
+        #limits the network as a whole once it pushes back.
+        MediaConnection.throttles[cls] = AdaptiveThrottle(None, self.backoff, self.max_backoff, self.logger)
+      return MediaConnection.throttles[cls]
+
+
+  def ready_in(self, url=None):
+    """ Return the number of seconds until a request to `url` could
+    go ahead, without reserving it. """
+    if self.waitfrom:
+      remaining = self.waitseconds - (datetime.datetime.now() - self.waitfrom).total_seconds()
+      if remaining > 0:
+        return remaining
+    bucket = self.bucket(url)
+    return max(self.throttle.ready_in(), bucket.delay() if bucket else 0)
+
+
+  def record_status(self, code):
+    """ Count a request and its outcome, by HTTP status (or None
+    where the request failed without one). """
+    self.requests += 1
+    self.laststatus = code
+    if code is None or code >= 400:
+      self.errors += 1
+    if code in self.auth_error_codes:
+      self.autherrors += 1
+    if code in self.throttle_codes:
+      self.throttle.throttled()
+    elif code is not None and code < 400:
+      self.throttle.success()
+
+
+  def wait_time(self, url=None):
+    """ Return the number of seconds to wait before a request to `url`:
+    what remains of a flagged wait period or, if there is none, the
+    delay before the rate limit allows the request. In the latter case
+    the request's place is reserved, so it should then go ahead. Clears
+    the flag once the wait period is over. """
+    if self.waitfrom:
+      diff = datetime.datetime.now() - self.waitfrom
+      remaining = self.waitseconds - diff.total_seconds()
+      if remaining > 0:
+        return remaining
+      self.waitfrom = None
+    bucket = self.bucket(url)
+    return max(self.throttle.reserve(), bucket.reserve() if bucket else 0)
+
+
+  def wait(self, url=None):
+    """ Wait until a request to `url` is allowed by the rate limit, 
+    or until the end of the waiting period when flag_wait has 
+    been called. """
+    while True:
+      seconds = self.wait_time(url)
+      if self.waitfrom:
+        self.logger.info("Waiting {:.0f} more seconds of {}".format(seconds, self.waitseconds))
+      elif seconds > 0:
+        self.logger.info('Delay of {:.2f}'.format(seconds))
+      time.sleep(seconds)
+      if not self.waitfrom:
+        break
 
 
   def get(self, url, params):
-    """ Query a resource using the given parameters. 
+    """ Query a resource using the given parameters, after waiting
+    as required by rate limiting.
     
     :param str url: The url to query.
     :param dict params: A dictionary of parameters to query for. 
     :return dict jsonobj: The result of self.handle_response(). Could be None. """
+    cached = self.from_cache(url, params)
+    if cached is not None:
+      return cached
+    for attempt in range(self.retries + 1):
+      self.wait(url)
+      result = self.fetch(url, params)
+      if self.laststatus not in self.throttle_codes:
+        break
+      self.logger.info("Throttled requesting `{}`; attempt {} of {}.".format(url, attempt+1, self.retries+1))
+    return result
+
+
+  def from_cache(self, url, params):
+    """ Return the handled response for a query from the response
+    cache, or None if it is not cached. """
+    if not self.cache:
+      return None
+    text = self.cache.get(self.cache.key(url, params), url)
+    if text is None:
+      return None
+    self.logger.info('Cached response for `{}`'.format(url))
+    self.lasturl = url
+    self.lastparams = params
+    return self.handle_response(text, None)
+
+
+  def to_cache(self, key, text, result):
+    """ Cache a response if it was a success, i.e. it was handled
+    without error and did not trigger a rate-limit wait. """
+    if key and text is not None and result is not None and not self.waitfrom:
+      self.cache.put(key, text)
+
+
+  def rewrite(self, url):
+    """ Apply any host replacement in MediaConnection.hosts to a url. """
+    for host, replacement in self.hosts.items():
+      if url.startswith(host):
+        return replacement + url[len(host):]
+    return url
+
+
+  def open(self, req):
+    """ Open a request built by build_request(). """
+    req.full_url = self.rewrite(req.full_url)
+    if self.cassette:
+      return self.cassette.urlopen(req, timeout=MediaConnection.timeout)
+    return urlopen(req,timeout=MediaConnection.timeout)
+
+
+  def fetch(self, url, params):
+    """ Query a resource immediately, without any rate-limit wait.
+    Takes the same parameters as get(). """
+    key = self.cache.key(url, params) if self.cache else None
     req = self.build_request(url,params)
     self.lasturl = url
     self.lastparams = params
     request,ret = None,None
-    self.wait()
     try:
-      request = urlopen(req,timeout=MediaConnection.timeout)
+      request = self.open(req)
       content = request.read()
       ret = content.decode('utf-8')
+      self.update_limits(url, request.headers)
+      self.record_status(request.status)
     except Exception as e:
       self.logger.warn("Exception while requesting `{}`".format(req))
+      self.update_limits(url, getattr(e, 'headers', None))
+      self.record_status(getattr(e, 'code', None))
       self.handle_error(e) 
-    return self.handle_response(ret, None)      
+    result = self.handle_response(ret, None)
+    self.to_cache(key, ret, result)
+    return result
 
 
 class JSONConnection(MediaConnection):
   
-  def handle_response(self,response_text, headers):
+  def handle_response(self,response_text, headers=None):
     ret = None
     try:
       ret = json.loads(response_text)
@@ -119,6 +376,14 @@ class JSONConnection(MediaConnection):
       self.logger.debug(json)
       self.logger.warn(e)
     return ret
+
+
+  def error_json(self, error_obj):
+    """ Return the parsed JSON body of an HTTP error, or None. """
+    try:
+      return json.loads(self.error_body(error_obj))
+    except Exception:
+      return None
     
 
 class OauthConnection(MediaConnection):
@@ -135,7 +400,10 @@ class OauthConnection(MediaConnection):
     access_token = oauth.Token(key=user_token,
                                secret=user_secret)
     client = oauth.Client(consumer,access_token,timeout=MediaConnection.timeout)
+    #The client keeps its connections alive between requests, but can
+    #only make one request at a time.
     self.client = client
+    self.clientlock = threading.Lock()
     super().__init__(logger)
 
   def build_request(self,url,params):
@@ -145,37 +413,63 @@ class OauthConnection(MediaConnection):
     self.logger.info('Built request `{}`'.format(requrl))
     return requrl
 
-  def get(self, url, params):
-    """ Query a resource using the given parameters. 
+  def open(self, req):
+    """ Make a request built by build_request() with the OAuth client,
+    returning the response headers and content. """
+    req = self.rewrite(req)
+    with self.clientlock:
+      if self.cassette:
+        return self.cassette.request(self.client, req, "GET")
+      return self.client.request(req, "GET")
+
+  def fetch(self, url, params):
+    """ Query a resource immediately, without any rate-limit wait.
     
     :param str url: The url to query.
     :param dict params: A dictionary of parameters to query for. 
     :return dict jsonobj: The result of self.handle_response(). Could be None. """
+    key = self.cache.key(url, params) if self.cache else None
     req = self.build_request(url,params)
     self.lasturl = url
     self.lastparams = params
     ret = None
     resp = None
-    self.wait()
     try:
-      resp, content = self.client.request(req, "GET")
+      resp, content = self.open(req)
       ret = content.decode('utf-8')
+      self.update_limits(url, resp)
+      self.record_status(int(resp.status) if resp and 'status' in resp else None)
       self.logger.info("Response code {}.".format(resp))
     except Exception as e:
       self.logger.warn("Exception while oauth-requesting `{}`".format(url))
+      self.record_status(None)
       self.handle_error(e) 
-    return self.handle_response(ret, resp)      
+    result = self.handle_response(ret, resp)
+    self.to_cache(key, ret, result)
+    return result
 
 
 class JSONOauthConnection(OauthConnection):
   
-  def handle_response(self,response_text, headers):
+  def handle_response(self,response_text, headers=None):
     return JSONConnection.handle_response(self,response_text, headers)
 
 
 class PooledConnection:
+  """ A pool of connections, one per set of credentials, which share
+  out requests. Each connection carries at most `per_key` requests
+  at a time, so the pool as a whole can be used by up to `capacity`
+  threads at once.
+
+  Each request goes to the free connection whose rate limit lets it
+  go ahead soonest, taking turns among those equally ready. Keys
+  refused with an authentication error are quarantined, and left out
+  of rotation for `quarantine_seconds`. """
 
-  def __init__(self, credential_file, connection_class, logger):
+  retries = 3
+  quarantine_seconds = 3600
+
+  def __init__(self, credential_file, connection_class, logger, per_key=1):
     self.pool = []
     for line in open(credential_file,'r'):
       if ' ' in line:
@@ -184,31 +478,122 @@ class PooledConnection:
         self.pool.append(connection_class(line.strip(),logger))
     if len(self.pool) == 0:
       raise ValueError('Credentials file {} did not produce any connections')
+    self.logger = self.pool[0].logger
+    self.per_key = per_key
+    self.capacity = len(self.pool) * per_key
+    self.busy = [0] * len(self.pool)
+    self.quarantined = {}
+    self.turn = 0
+    self.condition = threading.Condition()
 
-  def get_connection(self):
-    now  = datetime.datetime.now()
-    connection = None
-    for con in self.pool:
-      if not con.waitfrom:
-        connection = con
-        break
-      else:
-        diff = now - con.waitfrom
-        if diff.seconds >= con.waitseconds:
-          con.waitfrom = None
-          connection = con
-          break
-    if not connection:
-      connection = self.pool[0]
-    return connection
+  def is_quarantined(self, connection):
+    i = self.pool.index(connection)
+    with self.condition:
+      if i in self.quarantined and time.time() - self.quarantined[i] >= self.quarantine_seconds:
+        #Give the key another chance.
+        del self.quarantined[i]
+      return i in self.quarantined
+
+  def quarantine(self, connection):
+    i = self.pool.index(connection)
+    self.logger.warn("Key {} of the pool was refused; taking it out of rotation.".format(i))
+    with self.condition:
+      self.quarantined[i] = time.time()
+
+  def get_connection(self, exclude=(), url=None):
+    """ Return the best free connection in the pool, or None if
+    every connection is carrying its full load. Quarantined keys are
+    only used if every key is quarantined. """
+    candidates = [i for i, con in enumerate(self.pool)
+                  if self.busy[i] < self.per_key and con not in exclude]
+    healthy = [i for i in candidates if not self.is_quarantined(self.pool[i])]
+    if healthy or len(self.quarantined) < len(self.pool):
+      candidates = healthy
+    if not candidates:
+      return None
+    n = len(self.pool)
+    best = min(candidates, key=lambda i: (self.pool[i].ready_in(url), (i - self.turn) % n))
+    self.turn = best + 1
+    return self.pool[best]
+
+  def checkout(self, exclude=(), url=None):
+    """ Reserve a connection for one request, blocking until one is free. """
+    with self.condition:
+      while True:
+        connection = self.get_connection(exclude, url)
+        if connection is None and exclude:
+          connection = self.get_connection(url=url)
+        if connection is not None:
+          self.busy[self.pool.index(connection)] += 1
+          return connection
+        self.condition.wait()
+
+  def checkin(self, connection):
+    with self.condition:
+      self.busy[self.pool.index(connection)] -= 1
+      self.condition.notify()
+
+  def _get(self, connection, url, params):
+    autherrors = connection.autherrors
+    try:
+      return connection.get(url, params)
+    finally:
+      if connection.autherrors > autherrors:
+        self.quarantine(connection)
+      self.checkin(connection)
 
   def get(self, url, params):
-    connection = self.get_connection()
-    result = connection.get(url, params)
-    if connection.waitfrom:
-      connection = self.get_connection()
-      result = connection.get(url, params)
+    cached = self.pool[0].from_cache(url, params)
+    if cached is not None:
+      self.lasturl, self.lastparams = url, params
+      return cached
+    tried = []
+    for attempt in range(self.retries):
+      connection = self.checkout(exclude=tried, url=url)
+      result = self._get(connection, url, params)
+      tried.append(connection)
+      if not connection.waitfrom and not self.is_quarantined(connection):
+        break
+      self.logger.info("Retrying `{}` with another key.".format(url))
     self.lasturl = connection.lasturl
     self.lastparams = connection.lastparams
     return result
-    
+
+  def stats(self):
+    """ Return a dict of request statistics for each key in the pool,
+    in order. """
+    return [{'requests': con.requests,
+             'errors': con.errors,
+             'autherrors': con.autherrors,
+             'busy': self.busy[i],
+             'ready_in': con.ready_in(),
+             'quarantined': i in self.quarantined}
+            for i, con in enumerate(self.pool)]
+
+
+def use_cache(dirpath, logger=None, **kwargs):
+  """ Cache the responses of all connections on disk in `dirpath`.
+  Further arguments are passed to ResponseCache().
+
+  :return: The ResponseCache in use. """
+  import common.responsecache
+  MediaConnection.cache = common.responsecache.ResponseCache(dirpath, logger=logger, **kwargs)
+  return MediaConnection.cache
+
+
+def use_cassette(filename, mode='auto', logger=None):
+  """ Record or replay the responses of all connections with a
+  cassette file. See common.cassette.Cassette for the modes.
+
+  :return: The Cassette in use. """
+  import common.cassette
+  MediaConnection.cassette = common.cassette.Cassette(filename, mode, logger)
+  return MediaConnection.cassette
+
+
+def use_server(base_url, hosts=None):
+  """ Send requests for the APIs' hosts to another server instead, such
+  as a common.fakeserver listening at `base_url`. """
+  import common.fakeserver
+  for host in hosts or common.fakeserver.api_hosts:
+    MediaConnection.hosts[host] = base_url.rstrip('/')
@@ -1,6 +1,9 @@
 
 import os
 import json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 try:
   import common.logger
@@ -9,11 +12,15 @@ except ImportError as ie:
   path.append(os.path.abspath('.'))
   path.append(os.path.abspath('..'))
   import common.logger
+import common.aioconnect
+import common.rawstore
 
 
 class Downloader():
   
   network_name = 'None'
+  max_workers = 8
+  complete_marker = {'complete': True}
 
   def __init__(self, profilestore, connection, logger=None):
     self.profilestore = profilestore
@@ -21,32 +28,195 @@ class Downloader():
     if not logger:
       logger = common.logger.getLogger(self.__class__.__name__)
     self.logger = logger
-    self.cache = []
+    self.local = threading.local()
+    self.aconnection = None
+    self.loop = None
+    self.rawstores = {}
+    self.streaming = False
+
+  @property
+  def cache(self):
+    """ The bundles collected for the record being downloaded by
+    the current thread. """
+    if not hasattr(self.local, 'cache'):
+      self.local.cache = []
+    return self.local.cache
 
   def get_bundled(self, url, params):
-    result = self.connection.get(url, params)
+    #Connections add credentials and the like to the params they are
+    #given; keep those the downloader asked for, which may be reused.
+    query_params = params
+    params = dict(params)
+    if self.streaming:
+      replayed = self.local.replay.get(self._replay_key(url, query_params))
+      if replayed:
+        #Already fetched before this download was interrupted.
+        self.local.replayfh.seek(replayed.pop(0))
+        return json.loads(self.local.replayfh.readline())['result']
+    if self.aconnection:
+      #On a download thread of run_async(); the request is made by the loop.
+      future = asyncio.run_coroutine_threadsafe(self.aconnection.get(url, params), self.loop)
+      result = future.result()
+    else:
+      result = self.connection.get(url, params)
     bundle = {'query_url': url,
-              'query_params': params,
+              'query_params': query_params,
               'result' : result}
-    self.cache.append(bundle)
+    if self.streaming:
+      self.local.partial.write(json.dumps(bundle)+'\n')
+      self.local.partial.flush()
+    else:
+      self.cache.append(bundle)
     return result
+
+  def _replay_key(self, url, params):
+    return url, json.dumps(params, sort_keys=True)
+
+  def _partial_path(self, dirpath, record):
+    return os.path.join(dirpath, 'partial', str(record['uid'])+'.jsonl')
+
+  def _read_partial(self, path):
+    """ Index the requests in a partial download by their offsets in
+    the file, and report whether it was complete. Any partly-written
+    last line is truncated away. """
+    replay = {}
+    complete = False
+    if not os.path.exists(path):
+      return replay, complete
+    with open(path, 'r+b') as fh:
+      good = 0
+      for line in iter(fh.readline, b''):
+        if not line.endswith(b'\n'):
+          break
+        bundle = json.loads(line.decode('utf-8'))
+        if bundle == self.complete_marker:
+          complete = True
+          break
+        key = self._replay_key(bundle['query_url'], bundle['query_params'])
+        replay.setdefault(key, []).append(good)
+        good += len(line)
+      if not complete:
+        fh.truncate(good)
+    return replay, complete
     
+  def rawstore(self, dirpath):
+    """ Return the RawStore for a directory. """
+    if dirpath not in self.rawstores:
+      self.rawstores[dirpath] = common.rawstore.RawStore(dirpath, self.logger)
+    return self.rawstores[dirpath]
+
   def flush(self,dirpath,record):
-    fh = open(dirpath+os.sep+str(record['uid'])+'.json','w')
-    json.dump(self.cache,fh)
-    fh.close()
-    self.cache = []
+    if self.streaming:
+      path = self._partial_path(dirpath, record)
+      with open(path, 'r', encoding='utf-8') as fh:
+        marker = json.dumps(self.complete_marker)+'\n'
+        bundles = (line.rstrip('\n') for line in fh if line != marker)
+        self.rawstore(dirpath).put_stream(record['uid'], bundles)
+      os.remove(path)
+      return
+    self.rawstore(dirpath).put(record['uid'], self.cache)
+    self.local.cache = []
 
   def download(self, record):
     raise NotImplementedError('`download()` not implemented for {}'.format(self.__class__.__name__))
 
-  def run(self, dirpath='raw'):
-    try:
-      os.mkdir(dirpath) 
-    except FileExistsError:
-      pass
-    dlist = os.listdir(dirpath)
-    for record in self.profilestore.records:
-      if record['network'] == self.network_name and str(record['uid'])+'.json' not in dlist:
+  def _download_record(self, dirpath, record):
+    if self.streaming:
+      return self._stream_record(dirpath, record)
+    self.local.cache = []
+    self.download(record)
+    self.flush(dirpath,record)
+    return record
+
+  def _stream_record(self, dirpath, record):
+    """ Download a record as _download_record(), but write each bundle
+    to a partial JSON-lines file as it arrives. A partial file left by
+    an interrupted download is resumed: its requests are answered from
+    the file rather than repeated. """
+    path = self._partial_path(dirpath, record)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    self.local.replay, complete = self._read_partial(path)
+    if not complete:
+      with open(path, 'a', encoding='utf-8') as self.local.partial, open(path, 'rb') as self.local.replayfh:
         self.download(record)
-        self.flush(dirpath,record)
+        self.local.partial.write(json.dumps(self.complete_marker)+'\n')
+    self.local.replay = {}
+    self.flush(dirpath, record)
+    return record
+
+  def _pending_records(self, dirpath):
+    """ Return the records for this network not yet downloaded. """
+    rawstore = self.rawstore(dirpath)
+    records = []
+    for record in self.profilestore.pending('downloaded', self.network_name):
+      if record['uid'] in rawstore:
+        #Downloaded, but not marked so (or marked before progress was tracked in the store).
+        self.profilestore.mark_done(record['uid'], 'downloaded')
+        if os.path.exists(self._partial_path(dirpath, record)):
+          os.remove(self._partial_path(dirpath, record))
+      else:
+        records.append(record)
+    return records
+
+  def run(self, dirpath='raw', workers=1, streaming=False):
+    """ Download every record for this network not yet downloaded.
+
+    :param str dirpath: The directory to write raw responses to.
+    :param int workers: The number of records to download at once. This is capped by Downloader.max_workers and by the number of requests the connection can carry at once.
+    :param bool streaming: Write each response to disk as it arrives rather than holding a record's responses in memory, and resume interrupted records. """
+    self.streaming = streaming
+    records = self._pending_records(dirpath)
+    workers = min(workers, self.max_workers, getattr(self.connection, 'capacity', 1))
+    if workers <= 1:
+      for record in records:
+        self._download_record(dirpath, record)
+        self.profilestore.mark_done(record['uid'], 'downloaded')
+      return
+    self.logger.info("Downloading {} records with {} workers.".format(len(records), workers))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+      futures = [executor.submit(self._download_record, dirpath, record) for record in records]
+      for future in as_completed(futures):
+        try:
+          record = future.result()
+        except Exception as e:
+          self.logger.warn("Exception while downloading: {}".format(e))
+          continue
+        #The store is only touched from this thread.
+        self.profilestore.mark_done(record['uid'], 'downloaded')
+
+  def run_async(self, dirpath='raw', concurrency=10, streaming=False):
+    """ Download every record for this network not yet downloaded,
+    as run(), but with requests made through common.aioconnect from an
+    asyncio event loop. Rate-limit waits and lockouts are awaited
+    there rather than slept, so a key waiting out a lockout does not
+    hold up the others.
+
+    :param str dirpath: The directory to write raw responses to.
+    :param int concurrency: The number of records to download at once.
+    :param bool streaming: As for run(). """
+    self.streaming = streaming
+    asyncio.run(self._run_async(dirpath, concurrency))
+
+  async def _run_async(self, dirpath, concurrency):
+    records = self._pending_records(dirpath)
+    self.loop = asyncio.get_running_loop()
+    self.aconnection = common.aioconnect.wrap(self.connection)
+    #download() implementations are written as blocking code, so each
+    #runs on a thread of its own, handing its requests to the loop. The
+    #requests are made on the loop's default executor, so these threads
+    #cannot starve them.
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    self.logger.info("Downloading {} records, {} at a time.".format(len(records), concurrency))
+    try:
+      futures = [self.loop.run_in_executor(executor, self._download_record, dirpath, record) for record in records]
+      for future in asyncio.as_completed(futures):
+        try:
+          record = await future
+        except Exception as e:
+          self.logger.warn("Exception while downloading: {}".format(e))
+          continue
+        self.profilestore.mark_done(record['uid'], 'downloaded')
+    finally:
+      executor.shutdown()
+      self.aconnection = None
+      self.loop = None
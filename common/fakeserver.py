@@ -0,0 +1,331 @@
+""" A local stand-in for the APIs used by the downloaders, for testing
+and benchmarking offline. It serves the Google+, Twitter, Facebook and
+LinkedIn endpoints the downloaders request, from a recorded cassette
+(see common.cassette) where it has a response, and otherwise from
+synthetic data generated deterministically from the request. It can
+add latency, fail a proportion of requests, and enforce a rate limit
+per credential with Twitter-style x-rate-limit headers.
+
+Connections are pointed at it with common.connect.use_server(). """
+
+import json
+import time
+import zlib
+import random
+import struct
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qsl, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+try:
+  import common.cassette
+except ImportError as ie:
+  from sys import path
+  import os
+  path.append(os.path.abspath('.'))
+  path.append(os.path.abspath('..'))
+  import common.cassette
+
+
+api_hosts = ['https://www.googleapis.com',
+             'https://api.twitter.com',
+             'https://graph.facebook.com',
+             'https://api.linkedin.com',
+             'https://www.linkedin.com']
+
+words = ['data', 'music', 'coffee', 'travel', 'photos', 'science', 'weekend', 'football', 'research', 'garden']
+names = ['Alex', 'Sam', 'Jo', 'Chris', 'Robin', 'Morgan', 'Charlie', 'Jamie']
+surnames = ['Smith', 'Jones', 'Taylor', 'Brown', 'Williams', 'Wilson', 'Evans', 'Thomas']
+
+
+def png(rng, size=16):
+  """ Return a small random-coloured PNG image. """
+  colour = bytes(rng.randrange(256) for i in range(3))
+  rows = b''.join(b'\x00' + colour * size for i in range(size))
+  def chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+  header = struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)
+  return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b'')
+
+
+class Synthesiser:
+  """ Generates plausible responses for each endpoint. The same request
+  always gets the same response. """
+
+  def __init__(self, base_url, seed=0):
+    self.base_url = base_url
+    self.seed = seed
+
+  def rng(self, *parts):
+    return random.Random(zlib.crc32(repr((self.seed,)+parts).encode('utf-8')))
+
+  def text(self, rng, n=8):
+    return ' '.join(rng.choice(words) for i in range(n))
+
+  def name(self, rng):
+    return rng.choice(names), rng.choice(surnames)
+
+  def image(self, *parts):
+    return '{}/img/{}.png'.format(self.base_url, zlib.crc32(repr(parts).encode('utf-8')))
+
+  def respond(self, path, params):
+    """ Return the status and JSON-able body for a request. """
+    segments = [unquote(s) for s in path.strip('/').split('/')]
+    if path.startswith('/plus/v1/'):
+      return self.gplus(segments[2:], params)
+    if path.startswith('/1.1/'):
+      return self.twitter('/'.join(segments[1:]), params)
+    if path.startswith('/v1/people/'):
+      return self.linkedin(segments[2], params)
+    if path.startswith('/pub/dir'):
+      return self.linkedin_search(params)
+    return self.facebook(segments, params)
+
+  #Google+
+
+  def gplus_person(self, uid):
+    rng = self.rng('gplus', uid)
+    given, family = self.name(rng)
+    return {'kind': 'plus#person', 'id': uid, 'displayName': given+' '+family,
+            'name': {'givenName': given, 'familyName': family, 'formatted': given+' '+family},
+            'gender': rng.choice(['male', 'female', 'other']),
+            'aboutMe': self.text(rng), 'circledByCount': rng.randrange(1000),
+            'urls': [{'value': 'http://example.com/'+uid, 'type': 'other'}],
+            'image': {'url': self.image('gplus', uid)}}
+
+  def gplus(self, segments, params):
+    if segments[0] == 'people' and len(segments) == 2:
+      return 200, self.gplus_person(segments[1])
+    if segments[0] == 'people' and len(segments) == 1:
+      return 200, {'items': [self.gplus_person(str(i)) for i in range(self.rng('gsearch', params.get('query')).randrange(10))]}
+    if segments[0] == 'people':
+      uid = segments[1]
+      rng = self.rng('gplus-activities', uid)
+      items = []
+      for i in range(rng.randrange(20)):
+        items.append({'id': '{}-{}'.format(uid, i), 'published': '2014-{:02d}-{:02d}T{:02d}:00:00.000Z'.format(rng.randrange(1, 13), rng.randrange(1, 29), rng.randrange(24)),
+                      'actor': {'id': uid},
+                      'object': {'originalContent': self.text(rng),
+                                 'replies': {'totalItems': rng.randrange(3)},
+                                 'plusoners': {'totalItems': rng.randrange(3)},
+                                 'resharers': {'totalItems': rng.randrange(2)}}})
+      return 200, {'kind': 'plus#activityFeed', 'items': items}
+    aid, kind = segments[1], segments[2]
+    rng = self.rng('gplus', kind, aid)
+    people = [self.gplus_person(str(rng.randrange(10**6))) for i in range(rng.randrange(1, 4))]
+    if kind == 'comments':
+      return 200, {'items': [{'actor': p, 'published': '2014-06-01T12:00:00.000Z',
+                              'object': {'content': self.text(rng)}, 'plusoners': {'totalItems': 0}} for p in people]}
+    return 200, {'items': people}
+
+  #Twitter
+
+  def twitter_user(self, screen_name):
+    rng = self.rng('twitter', screen_name)
+    given, family = self.name(rng)
+    uid = rng.randrange(10**9)
+    return {'id': uid, 'id_str': str(uid), 'screen_name': screen_name, 'name': given+' '+family,
+            'description': self.text(rng), 'verified': False, 'contributors_enabled': False,
+            'created_at': 'Wed Aug 27 13:08:45 +0000 2008', 'location': rng.choice(['London', 'Leeds', '']),
+            'followers_count': rng.randrange(5000), 'friends_count': rng.randrange(500),
+            'statuses_count': rng.randrange(10000), 'favorites_count': rng.randrange(100),
+            'profile_image_url': self.image('twitter', screen_name)}
+
+  def twitter(self, endpoint, params):
+    screen_name = params.get('screen_name', 'user')
+    if endpoint == 'users/show.json':
+      return 200, self.twitter_user(screen_name)
+    if endpoint == 'statuses/user_timeline.json':
+      rng = self.rng('timeline', screen_name)
+      return 200, [{'id': rng.randrange(10**12), 'text': self.text(rng),
+                    'created_at': 'Mon Jun {:02d} {:02d}:00:00 +0000 2014'.format(rng.randrange(1, 29), rng.randrange(24)),
+                    'entities': {'user_mentions': [], 'hashtags': [], 'urls': []},
+                    'retweet_count': rng.randrange(5), 'favorite_count': rng.randrange(5)}
+                   for i in range(min(int(params.get('count', 20)), rng.randrange(50)))]
+    if endpoint in ('friends/list.json', 'followers/list.json'):
+      rng = self.rng(endpoint, screen_name)
+      return 200, {'users': [self.twitter_user('u{}'.format(rng.randrange(10**6))) for i in range(rng.randrange(20))],
+                   'next_cursor': 0, 'previous_cursor': 0}
+    if endpoint in ('users/search.json', 'users/contributors.json'):
+      rng = self.rng(endpoint, params.get('q', screen_name))
+      return 200, [self.twitter_user('u{}'.format(rng.randrange(10**6))) for i in range(rng.randrange(10))]
+    return 404, {'errors': [{'code': 34, 'message': 'Sorry, that page does not exist'}]}
+
+  #Facebook
+
+  def facebook(self, segments, params):
+    segments = [s for s in segments if s]
+    if not segments:
+      uid = params.get('id', '0')
+      rng = self.rng('facebook', uid)
+      given, family = self.name(rng)
+      return 200, {'id': uid, 'name': given+' '+family, 'about': self.text(rng),
+                   'link': 'https://www.facebook.com/'+uid, 'is_verified': False}
+    if segments == ['search']:
+      rng = self.rng('fbsearch', params.get('q'))
+      return 200, {'data': [{'id': str(rng.randrange(10**9)), 'name': params.get('q', '')} for i in range(rng.randrange(10))]}
+    oid, edge = segments[0], segments[-1]
+    rng = self.rng('facebook', edge, oid)
+    if edge == 'links':
+      return 200, {'data': [{'id': '{}_{}'.format(oid, i), 'created_time': '2014-05-{:02d}T10:00:00+0000'.format(rng.randrange(1, 29)),
+                             'message': self.text(rng), 'link': 'http://example.com/'+str(rng.randrange(10**6))}
+                            for i in range(rng.randrange(10))]}
+    if edge == 'comments':
+      return 200, {'data': [{'id': str(rng.randrange(10**9)), 'from': {'id': str(rng.randrange(10**9)), 'name': ' '.join(self.name(rng))},
+                             'message': self.text(rng), 'created_time': '2014-05-01T10:00:00+0000', 'like_count': rng.randrange(5)}
+                            for i in range(rng.randrange(5))],
+                   'summary': {'total_count': 0}}
+    return 400, {'error': {'message': 'Unsupported get request.', 'type': 'GraphMethodException', 'code': 100}}
+
+  #LinkedIn
+
+  def linkedin(self, selector, params):
+    url = selector.split(':(')[0][len('url='):]
+    rng = self.rng('linkedin', url)
+    given, family = self.name(rng)
+    return 200, {'id': str(rng.randrange(10**9)), 'firstName': given, 'lastName': family,
+                 'formattedName': given+' '+family, 'headline': self.text(rng, 4), 'industry': rng.choice(words),
+                 'location': {'name': 'London, United Kingdom', 'country': {'code': 'gb'}},
+                 'numConnections': rng.randrange(500), 'summary': self.text(rng),
+                 'pictureUrl': self.image('linkedin', url)}
+
+  def linkedin_search(self, params):
+    rng = self.rng('lisearch', params.get('first'), params.get('last'))
+    links = ['<a href="https://www.linkedin.com/in/{}">Public profile</a>'.format(rng.randrange(10**6)) for i in range(rng.randrange(5))]
+    return 200, '\n'.join(links)
+
+
+class FakeAPIServer(ThreadingHTTPServer):
+  """ The stand-in API server. Pass port 0 to listen on any free port;
+  `base_url` gives the address to use. """
+
+  daemon_threads = True
+
+  def __init__(self, host='127.0.0.1', port=0, latency=0, jitter=0, error_rate=0, rate_limit=None, cassette=None, seed=0):
+    """
+    :param float latency: Seconds to wait before each response.
+    :param float jitter: Up to this many further seconds are added to the latency at random.
+    :param float error_rate: The proportion of requests to fail with a 503.
+    :param tuple rate_limit: A (requests, seconds) budget per credential, beyond which requests get a 429.
+    :param str cassette: A cassette file to serve recorded responses from. """
+    super().__init__((host, port), FakeAPIHandler)
+    self.latency = latency
+    self.jitter = jitter
+    self.error_rate = error_rate
+    self.rate_limit = rate_limit
+    self.cassette = common.cassette.Cassette(cassette, 'replay') if cassette else None
+    self.synthesiser = Synthesiser(self.base_url, seed)
+    self.random = random.Random(seed)
+    self.windows = {}
+    self.requests = 0
+    self.lock = threading.Lock()
+    self.thread = None
+
+  @property
+  def base_url(self):
+    return 'http://{}:{}'.format(*self.server_address[:2])
+
+  def start(self):
+    """ Serve from a background thread. """
+    self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+    self.thread.start()
+    return self
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+  def budget(self, credential):
+    """ Spend one request of a credential's budget, returning the
+    requests remaining (negative if over budget) and the reset time. """
+    limit, window = self.rate_limit
+    now = time.time()
+    with self.lock:
+      start, used = self.windows.get(credential, (now, 0))
+      if now - start >= window:
+        start, used = now, 0
+      used += 1
+      self.windows[credential] = (start, used)
+    return limit - used, int(start + window)
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, format, *args):
+    pass
+
+  def send_body(self, status, body, content_type='application/json', headers={}):
+    if not isinstance(body, bytes):
+      body = (body if isinstance(body, str) else json.dumps(body)).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', content_type)
+    for k, v in headers.items():
+      self.send_header(k, v)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def credential(self, params):
+    for k in ('key', 'access_token', 'oauth_token'):
+      if k in params:
+        return params[k]
+    auth = self.headers.get('Authorization', '')
+    if 'oauth_token="' in auth:
+      return auth.split('oauth_token="')[1].split('"')[0]
+    return self.client_address[0]
+
+  def do_GET(self):
+    server = self.server
+    with server.lock:
+      server.requests += 1
+    parts = urlsplit(self.path)
+    params = dict(parse_qsl(parts.query))
+    if server.latency or server.jitter:
+      time.sleep(server.latency + server.random.uniform(0, server.jitter))
+    if parts.path.startswith('/img/'):
+      rng = random.Random(parts.path)
+      return self.send_body(200, png(rng), 'image/png')
+    headers = {}
+    if server.rate_limit:
+      remaining, reset = server.budget(self.credential(params))
+      headers = {'x-rate-limit-limit': str(server.rate_limit[0]),
+                 'x-rate-limit-remaining': str(max(0, remaining)),
+                 'x-rate-limit-reset': str(reset)}
+      if remaining < 0:
+        return self.send_body(429, {'errors': [{'code': 88, 'message': 'Rate limit exceeded'}]}, headers=headers)
+    if server.error_rate and server.random.random() < server.error_rate:
+      return self.send_body(503, {'error': 'Service Unavailable'}, headers=headers)
+    if server.cassette:
+      interaction = server.cassette.lookup(self.path)
+      if interaction:
+        headers.update((k, v) for k, v in interaction['headers'].items()
+                       if k in ('content-type', 'x-rate-limit-limit', 'x-rate-limit-remaining', 'x-rate-limit-reset'))
+        content_type = headers.pop('content-type', 'application/json')
+        return self.send_body(interaction['status'], interaction['body'], content_type, headers)
+    status, body = server.synthesiser.respond(parts.path, params)
+    content_type = 'text/html' if isinstance(body, str) else 'application/json'
+    self.send_body(status, body, content_type, headers)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Serve stand-in responses for the social network APIs.')
+  parser.add_argument('--host', default='127.0.0.1', help='The address to listen on.')
+  parser.add_argument('--port', '-p', type=int, default=8000, help='The port to listen on.')
+  parser.add_argument('--latency', type=float, default=0, help='Seconds to wait before each response.')
+  parser.add_argument('--jitter', type=float, default=0, help='Up to this many further seconds to wait, at random.')
+  parser.add_argument('--error-rate', type=float, default=0, help='The proportion of requests to fail with a 503.')
+  parser.add_argument('--rate-limit', type=int, nargs=2, metavar=('REQUESTS', 'SECONDS'), help='A request budget per credential and window.')
+  parser.add_argument('--cassette', help='A cassette file of recorded responses to serve.')
+  parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic data and errors.')
+  args = parser.parse_args()
+
+  server = FakeAPIServer(args.host, args.port, args.latency, args.jitter, args.error_rate,
+                         tuple(args.rate_limit) if args.rate_limit else None, args.cassette, args.seed)
+  print('Serving on {}'.format(server.base_url))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    server.server_close()
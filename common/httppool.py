@@ -0,0 +1,136 @@
+import io
+import gzip
+import zlib
+import threading
+import http.client
+import urllib.request
+from urllib.error import HTTPError
+from urllib.parse import urlsplit, urljoin
+
+
+class Response:
+  """ The body and status of a completed request, read in full so that
+  its connection can be reused. Offers the parts of the urlopen()
+  response interface used in this package. """
+
+  def __init__(self, url, status, reason, headers, body):
+    self.url = url
+    self.status = status
+    self.reason = reason
+    self.headers = headers
+    self.body = io.BytesIO(body)
+
+  def read(self, *args):
+    return self.body.read(*args)
+
+  def geturl(self):
+    return self.url
+
+  def info(self):
+    return self.headers
+
+  def close(self):
+    pass
+
+
+class HTTPPool:
+  """ Keeps persistent (keep-alive) connections to each host, so that
+  successive requests to the same API skip the TCP and TLS handshakes.
+  Connections are checked out for one request at a time, so the pool
+  can be shared between threads. Responses are requested gzipped, and
+  transparently decompressed. """
+
+  max_idle = 8
+  max_redirects = 5
+  stale_errors = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+  def __init__(self):
+    self.idle = {}
+    self.lock = threading.Lock()
+
+  def _checkout(self, scheme, host, timeout):
+    with self.lock:
+      idle = self.idle.get((scheme, host))
+      if idle:
+        return idle.pop(), True
+    if scheme == 'https':
+      return http.client.HTTPSConnection(host, timeout=timeout), False
+    return http.client.HTTPConnection(host, timeout=timeout), False
+
+  def _checkin(self, scheme, host, connection):
+    with self.lock:
+      idle = self.idle.setdefault((scheme, host), [])
+      if len(idle) < self.max_idle:
+        idle.append(connection)
+        return
+    connection.close()
+
+  def _request(self, url, headers, timeout):
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+      path += '?' + parts.query
+    headers = dict(headers)
+    headers.setdefault('Accept-Encoding', 'gzip')
+    headers.setdefault('Connection', 'keep-alive')
+    while True:
+      connection, reused = self._checkout(parts.scheme, parts.netloc, timeout)
+      connection.timeout = timeout
+      try:
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+      except self.stale_errors:
+        connection.close()
+        if reused:
+          #The server closed an idle connection; try a fresh one.
+          continue
+        raise
+      except Exception:
+        connection.close()
+        raise
+      if response.will_close:
+        connection.close()
+      else:
+        self._checkin(parts.scheme, parts.netloc, connection)
+      encoding = response.getheader('Content-Encoding', '').lower()
+      if encoding == 'gzip':
+        body = gzip.decompress(body)
+      elif encoding == 'deflate':
+        body = zlib.decompress(body)
+      return Response(url, response.status, response.reason, response.msg, body)
+
+  def urlopen(self, req, timeout=None):
+    """ Make a GET request as urllib.request.urlopen() does, following
+    redirects and raising urllib.error.HTTPError for error statuses.
+
+    :param req: A url, or a urllib.request.Request.
+    :param float timeout: The socket timeout in seconds. """
+    if isinstance(req, str):
+      req = urllib.request.Request(req)
+    url = req.full_url
+    headers = req.header_items()
+    for redirect in range(self.max_redirects + 1):
+      response = self._request(url, headers, timeout)
+      location = response.headers.get('Location')
+      if response.status in (301, 302, 303, 307, 308) and location:
+        url = urljoin(url, location)
+        continue
+      break
+    if response.status >= 400:
+      raise HTTPError(url, response.status, response.reason, response.headers, response.body)
+    return response
+
+
+pool = HTTPPool()
+
+
+def urlopen(req, timeout=None):
+  """ urllib.request.urlopen() over the shared pool of persistent
+  connections. Requests through a proxy, or not over HTTP, are
+  passed to urllib. """
+  url = req if isinstance(req, str) else req.full_url
+  scheme = urlsplit(url).scheme
+  if scheme not in ('http', 'https') or scheme in urllib.request.getproxies():
+    return urllib.request.urlopen(req, timeout=timeout)
+  return pool.urlopen(req, timeout)
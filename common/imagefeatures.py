@@ -0,0 +1,229 @@
+import os
+import csv
+import json
+import fcntl
+import array
+import base64
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+def describe(data):
+  """ Compute the descriptors of an image: its dimensions, the
+  histogram of its 128x128 thumbnail (768 bins, RGB) and a 64-bit
+  difference hash (dHash).
+
+  JPEGs are decoded straight to a reduced size, so even large images
+  are cheap to describe.
+
+  :param bytes data: The image file's content.
+  :return: A dict of `width`, `height`, `histogram` and `dhash`. """
+  import io
+  from PIL import Image
+  size = (128,128)
+  image = Image.open(io.BytesIO(data))
+  width, height = image.size
+  image.draft('RGB', size)
+  image = image.convert('RGB')
+  image.thumbnail(size, Image.LANCZOS)
+  return {'width': width,
+          'height': height,
+          'histogram': image.histogram(),
+          'dhash': dhash(image)}
+
+
+def dhash(image):
+  """ Return the 64-bit difference hash of a PIL image: one bit for
+  each horizontally adjacent pair of pixels in a 9x8 greyscale
+  reduction, set where the left is brighter than the right. """
+  from PIL import Image
+  pixels = list(image.convert('L').resize((9,8), Image.LANCZOS).getdata())
+  value = 0
+  for row in range(8):
+    for col in range(8):
+      value = value << 1 | (pixels[row*9+col] > pixels[row*9+col+1])
+  return value
+
+
+def _describe_file(path):
+  """ describe() a file, for the backfill process pool. Returns the
+  content hash and descriptors, or None if it is not an image. """
+  with open(path, 'rb') as fh:
+    data = fh.read()
+  try:
+    return hashlib.sha256(data).hexdigest(), describe(data)
+  except Exception:
+    return None
+
+
+class FeatureIndex:
+  """ The descriptors of the images in an ImageStore directory, kept in
+  its `features` file as one line of JSON per image, keyed by the
+  SHA-256 of its content. Histograms are stored packed, as base64
+  unsigned shorts. Entries appended by other processes are picked up
+  as they are needed.
+
+  The content hash of an image file is found from its name: blobs are
+  named by it, and the file saved for a URL is named by the MD5 of the
+  URL, which the store's `index` maps to it. Only files saved by
+  earlier versions are hashed, once each. """
+
+  def __init__(self, savedir):
+    self.savedir = savedir
+    self.filename = os.path.join(savedir, 'features')
+    self.indexfile = os.path.join(savedir, 'index')
+    self.features = {}
+    self.digests = {}
+    self.offset = 0
+    self.indexed = 0
+    self.lock = threading.Lock()
+
+  def _catch_up(self):
+    if not os.path.exists(self.filename):
+      return
+    with self.lock, open(self.filename, 'r') as fh:
+      fh.seek(self.offset)
+      for line in iter(fh.readline, ''):
+        if not line.endswith('\n'):
+          #Partly-written entry; read it next time.
+          break
+        self.offset += len(line.encode('utf-8'))
+        entry = json.loads(line)
+        self.features[entry.pop('hash')] = entry
+
+  def __contains__(self, digest):
+    if digest not in self.features:
+      self._catch_up()
+    return digest in self.features
+
+  def get(self, digest):
+    """ Return the descriptors of the image with a content hash, or None. """
+    if digest not in self:
+      return None
+    entry = dict(self.features[digest])
+    entry['histogram'] = array.array('H', base64.b64decode(entry['histogram'])).tolist()
+    return entry
+
+  def put(self, digest, features):
+    """ Store the descriptors of the image with a content hash. """
+    entry = dict(features, hash=digest)
+    #Thumbnails are 128x128, so no bin can exceed an unsigned short.
+    entry['histogram'] = base64.b64encode(array.array('H', features['histogram']).tobytes()).decode('ascii')
+    with open(self.filename, 'a') as fh:
+      fcntl.flock(fh, fcntl.LOCK_EX)
+      try:
+        fh.write(json.dumps(entry)+'\n')
+      finally:
+        fcntl.flock(fh, fcntl.LOCK_UN)
+
+  def _catch_up_index(self):
+    """ Read the ImageStore index entries appended since it was last
+    read, mapping the name of each URL's file to its content hash. """
+    if not os.path.exists(self.indexfile):
+      return
+    with self.lock, open(self.indexfile, 'r', newline='') as fh:
+      fh.seek(self.indexed)
+      for line in iter(fh.readline, ''):
+        if not line.endswith('\n'):
+          break
+        self.indexed += len(line.encode('utf-8'))
+        url, digest = next(csv.reader([line]))[:2]
+        self.digests[hashlib.md5(url.encode('utf-8')).hexdigest()] = digest
+
+  def digest(self, path):
+    """ Return the content hash of an image file in the store. """
+    name = os.path.basename(path).split('.')[0]
+    if len(name) == 64:
+      #A blob.
+      return name
+    if name not in self.digests:
+      self._catch_up_index()
+    if name not in self.digests:
+      #Saved by an earlier version, without an index entry.
+      with open(path, 'rb') as fh:
+        self.digests[name] = hashlib.sha256(fh.read()).hexdigest()
+    return self.digests[name]
+
+  def lookup(self, path):
+    """ Return the descriptors of an image file in the store, or None
+    if they have not been computed. """
+    return self.get(self.digest(path))
+
+  def image_files(self):
+    """ Yield the image files in the store: the blobs, and files saved
+    directly into the directory by earlier versions. """
+    for dirpath, dirnames, filenames in os.walk(os.path.join(self.savedir, 'blobs')):
+      for fn in filenames:
+        if not fn.endswith('.part'):
+          yield os.path.join(dirpath, fn)
+    for fn in os.listdir(self.savedir):
+      path = os.path.join(self.savedir, fn)
+      if '.' in fn and not fn.endswith('.part') and os.path.isfile(path):
+        yield path
+
+  def backfill(self, workers=None, logger=None):
+    """ Describe every image in the store which has not been described,
+    using a pool of `workers` processes.
+
+    :return: The number of images described. """
+    todo = []
+    for path in self.image_files():
+      name = os.path.basename(path).split('.')[0]
+      if len(name) == 64 and name in self:
+        #A blob, named by its content hash; already described.
+        continue
+      todo.append(path)
+    described = set()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+      for result in executor.map(_describe_file, todo, chunksize=16):
+        if result and result[0] not in described and result[0] not in self:
+          self.put(*result)
+          described.add(result[0])
+    if logger:
+      logger.info("Described {} of {} images.".format(len(described), len(todo)))
+    return len(described)
+
+
+#The FeatureIndex of each ImageStore directory, as used by lookup().
+indexes = {}
+
+
+def store_directory(path):
+  """ Return the ImageStore directory holding an image file, whether
+  in the sharded layout (`<dir>/ab/cd/<name>`, `<dir>/blobs/ab/cd/<name>`)
+  or saved directly into `<dir>`. """
+  parts = os.path.dirname(os.path.abspath(path)).split(os.sep)
+  if len(parts) > 2 and all(len(p) == 2 for p in parts[-2:]):
+    parts = parts[:-2]
+    if parts[-1] == 'blobs':
+      parts = parts[:-1]
+  return os.sep.join(parts)
+
+
+def lookup(path):
+  """ Return the stored descriptors of an image file, or None. """
+  savedir = store_directory(path)
+  if savedir not in indexes:
+    indexes[savedir] = FeatureIndex(savedir)
+  try:
+    return indexes[savedir].lookup(path)
+  except OSError:
+    return None
+
+
+if __name__ == '__main__':
+  import argparse
+  try:
+    import common.logger
+  except ImportError as ie:
+    from sys import path
+    path.append(os.path.abspath('.'))
+    path.append(os.path.abspath('..'))
+    import common.logger
+  parser = argparse.ArgumentParser(description='Compute descriptors for the images already in an ImageStore directory.')
+  parser.add_argument('directory', nargs='?', default='images', help='The ImageStore directory.')
+  parser.add_argument('--workers','-w', type=int, default=None, help='The number of processes to use (default: one per CPU).')
+  args = parser.parse_args()
+  logger = common.logger.getLogger('imagefeatures', level='info')
+  FeatureIndex(args.directory).backfill(args.workers, logger)
@@ -1,32 +1,242 @@
-from urllib.request import urlopen
+from common.httppool import urlopen
+from common.imagefeatures import FeatureIndex, describe
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
 import os
+import csv
+import time
+import fcntl
+import shutil
 import hashlib
+import threading
 
 
 class ImageStore:
+  """ Saves images to a directory, downloading them in the background
+  so that analysis is not held up waiting on the network.
 
+  save() returns the file an image will be saved to at once, and
+  queues the download for a pool of `workers` threads. Call drain()
+  before relying on the files being there; images which could not be
+  downloaded are reported by it, and simply never appear on disk.
 
-  def __init__(self, savedir='images', logger=None):
+  Each distinct image is stored once, as a blob named by the SHA-256
+  of its content under `blobs/`. The file for a URL is a hard link to
+  its blob, named by the MD5 of the URL. Both are fanned out into two
+  levels of subdirectories by the first characters of their names.
+  The `index` file maps each URL saved to its content hash, and the
+  `failed` file records URLs which could not be downloaded, so that
+  dead links are not tried again on every run. Files saved directly
+  into the directory by earlier versions are still used.
+
+  As each new image is saved, its descriptors (see common.imagefeatures)
+  are computed and added to the `features` file, if PIL is installed. """
+
+  timeout = 10     #Seconds to wait for an image server to respond.
+  retries = 2      #Further attempts at a failed download.
+  backoff = 1      #Seconds before the first retry, doubling each time.
+  #HTTP statuses meaning an image is gone for good.
+  dead_codes = (404, 410)
+  #Seconds before other failed downloads are tried again.
+  failure_ttl = 24*60*60
+
+  def __init__(self, savedir='images', logger=None, workers=8):
       if not os.path.exists(savedir):
           os.makedirs(savedir)
       self.logger = logger
       logger.info("Images to be saved to '{}'".format(savedir))
       self.SDIR = savedir
-      
-  def save(self,url):
-      """ Take a URL, generate a unique filename, save 
-          the image to said file and return the filename."""
+      self.workers = workers
+      self.executor = None
+      self.pending = {}
+      self.failed = []
+      self.lock = threading.Lock()
+      self.indexfile = os.path.join(savedir, 'index')
+      self.deadfile = os.path.join(savedir, 'failed')
+      self.hashes = {}
+      self.dead = {}
+      self.offsets = {self.indexfile: 0, self.deadfile: 0}
+      self.features = FeatureIndex(savedir)
+      self.describing = True
+      self._catch_up()
+
+  def _catch_up(self):
+      """ Read index and failure entries appended since they were last
+      read, including those written by other processes. """
+      with self.lock:
+          self._read_entries()
+
+  def _read_entries(self):
+      for path, table in ((self.indexfile, self.hashes), (self.deadfile, self.dead)):
+          if not os.path.exists(path):
+              continue
+          with open(path, 'r', newline='') as fh:
+              fh.seek(self.offsets[path])
+              for line in iter(fh.readline, ''):
+                  if not line.endswith('\n'):
+                      #Partly-written entry; read it next time.
+                      break
+                  self.offsets[path] += len(line.encode('utf-8'))
+                  row = next(csv.reader([line]))
+                  table[row[0]] = tuple(row[1:])
+
+  def _append(self, path, row):
+      with open(path, 'a', newline='') as fh:
+          fcntl.flock(fh, fcntl.LOCK_EX)
+          try:
+              csv.writer(fh, lineterminator='\n').writerow(row)
+          finally:
+              fcntl.flock(fh, fcntl.LOCK_UN)
+
+  @staticmethod
+  def extension(url):
+      """ Return the file extension to save the image at a URL with. """
+      ext = url.split('.')[-1]
+      if not ext.isalnum() or len(ext) > 5:
+          return 'img'
+      return ext.lower()
+
+  @staticmethod
+  def content_extension(content):
+      """ Return the file extension for an image, from its content. """
+      for magic, ext in ((b'\x89PNG', 'png'), (b'\xff\xd8', 'jpg'), (b'GIF8', 'gif'), (b'BM', 'bmp')):
+          if content.startswith(magic):
+              return ext
+      if content[:4] == b'RIFF' and content[8:12] == b'WEBP':
+          return 'webp'
+      return 'img'
+
+  def _sharded(self, name, ext, *subdirs):
+      return os.path.join(self.SDIR, *subdirs, name[:2], name[2:4], name+'.'+ext)
+
+  def blobname(self, digest, ext):
+      """ Return the blob file holding the image with content hash `digest`. """
+      return self._sharded(digest, ext, 'blobs')
+
+  def filename(self, url):
+      """ Return the file to which the image at a URL is saved. """
+      return self._sharded(hashlib.md5(url.encode('utf-8')).hexdigest(), self.extension(url))
+
+  def _legacy_filename(self, url):
       ext = url.split('.')[-1]
-      filename = self.SDIR+os.sep+hashlib.md5(url.encode('utf-8')).hexdigest()+'.'+ext
+      return self.SDIR+os.sep+hashlib.md5(url.encode('utf-8')).hexdigest()+'.'+ext
+
+  def is_dead(self, url):
+      """ Whether a URL failed to download recently, or is gone. """
+      if url not in self.dead:
+          self._catch_up()
+      if url not in self.dead:
+          return False
+      status, when = self.dead[url]
+      return status in map(str, self.dead_codes) or time.time() - float(when) < self.failure_ttl
+
+  def save(self,url):
+      """ Take a URL, generate a unique filename, queue the image
+          to be saved to said file and return the filename. Returns
+          None for URLs which recently failed to download. """
+      legacy = self._legacy_filename(url)
+      if os.path.exists(legacy):
+          return legacy
+      filename = self.filename(url)
       if os.path.exists(filename):
           self.logger.debug('`{}` already exists'.format(filename))
           return filename
-      try:
-          self.logger.debug("Logging '{}' to file.".format(url))
-          content = urlopen(url).read()
-          f = open(filename,'wb') 
-          f.write(content)
-          f.close()
-      except:
+      if url not in self.hashes:
+          self._catch_up()
+      if url in self.hashes and os.path.exists(self.blobname(*self.hashes[url])):
+          self._link(self.blobname(*self.hashes[url]), filename)
+          return filename
+      if self.is_dead(url):
+          self.logger.debug("Not retrying failed image '{}'.".format(url))
           return None
-      return filename 
+      with self.lock:
+          if url not in self.pending:
+              if not self.executor:
+                  self.executor = ThreadPoolExecutor(max_workers=self.workers)
+              self.logger.debug("Queueing '{}' to be saved.".format(url))
+              self.pending[url] = self.executor.submit(self._fetch, url, filename)
+      return filename
+
+  def _link(self, blob, filename):
+      os.makedirs(os.path.dirname(filename), exist_ok=True)
+      try:
+          os.link(blob, filename)
+      except FileExistsError:
+          pass
+      except OSError:
+          #No hard links on this filesystem; fall back to a copy.
+          shutil.copyfile(blob, filename)
+
+  def _fetch(self, url, filename):
+      """ Download an image to its blob, retrying on failure, and link
+      its file to it. Returns whether it succeeded. """
+      status = None
+      for attempt in range(self.retries + 1):
+          if attempt:
+              time.sleep(self.backoff * 2 ** (attempt - 1))
+          try:
+              content = urlopen(url, timeout=self.timeout).read()
+          except HTTPError as e:
+              self.logger.debug("Failed to save '{}': {}".format(url, e))
+              status = e.code
+              if status in self.dead_codes:
+                  break
+              continue
+          except Exception as e:
+              self.logger.debug("Failed to save '{}': {}".format(url, e))
+              continue
+          ext = self.content_extension(content)
+          digest = hashlib.sha256(content).hexdigest()
+          blob = self.blobname(digest, ext)
+          if not os.path.exists(blob):
+              os.makedirs(os.path.dirname(blob), exist_ok=True)
+              #Write under a temporary name, so a file that exists is complete.
+              tmpname = '{}.{}.{}.part'.format(blob, os.getpid(), threading.get_ident())
+              with open(tmpname, 'wb') as f:
+                  f.write(content)
+              os.replace(tmpname, blob)
+              self._describe(digest, content)
+          self._link(blob, filename)
+          self._append(self.indexfile, [url, digest, ext])
+          return True
+      self._append(self.deadfile, [url, status or '', time.time()])
+      return False
+
+  def _describe(self, digest, content):
+      """ Compute and store the descriptors of a newly saved image. """
+      if not self.describing or digest in self.features:
+          return
+      try:
+          self.features.put(digest, describe(content))
+      except ImportError:
+          self.logger.warn("PIL is not installed; image descriptors will not be computed.")
+          self.describing = False
+      except Exception as e:
+          self.logger.debug("Could not describe image {}: {}".format(digest, e))
+
+  def drain(self):
+      """ Wait for all queued images to be saved.
+
+      :return: The URLs which could not be downloaded since the last drain(). """
+      while True:
+          with self.lock:
+              pending = self.pending
+              self.pending = {}
+          if not pending:
+              break
+          for url, future in pending.items():
+              if not future.result():
+                  self.failed.append(url)
+      with self.lock:
+          failed, self.failed = self.failed, []
+      if failed:
+          self.logger.warn("{} images could not be saved.".format(len(failed)))
+      return failed
+
+  def close(self):
+      """ Wait for queued images, and stop the download threads. """
+      failed = self.drain()
+      if self.executor:
+          self.executor.shutdown()
+          self.executor = None
+      return failed
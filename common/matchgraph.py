@@ -0,0 +1,78 @@
+class MatchGraph:
+  """ Holds the known matches between profile uids. Matches are
+  kept as a forward adjacency map (as written to the matches file),
+  a reverse adjacency map, and a union-find structure over the
+  connected components, so that membership queries do not need
+  to walk every pair. All uids are held as strings. """
+
+  def __init__(self):
+    self.forward = {}
+    self.reverse = {}
+    self.parent = {}
+    self.members = {}
+
+  def add(self, uidfrom, uidto):
+    """ Record a match between two uids.
+
+    :return: True if the pair was new, False if it was already known. """
+    uidfrom, uidto = str(uidfrom), str(uidto)
+    targets = self.forward.setdefault(uidfrom, [])
+    if uidto in targets:
+      return False
+    targets.append(uidto)
+    self.reverse.setdefault(uidto, []).append(uidfrom)
+    self._union(uidfrom, uidto)
+    return True
+
+  def is_matched(self, uid):
+    """ Check if a uid takes part in any match. """
+    uid = str(uid)
+    return uid in self.forward or uid in self.reverse
+
+  def is_match(self, uidfrom, uidto):
+    """ Check if two uids have been directly matched, in either direction. """
+    uidfrom, uidto = str(uidfrom), str(uidto)
+    return uidto in self.forward.get(uidfrom, ()) or uidfrom in self.forward.get(uidto, ())
+
+  def matches_of(self, uid):
+    """ Return the set of uids directly matched to a uid. """
+    uid = str(uid)
+    return set(self.forward.get(uid, ())) | set(self.reverse.get(uid, ()))
+
+  def component_of(self, uid):
+    """ Return the set of uids transitively matched to a uid,
+    including the uid itself. """
+    uid = str(uid)
+    if uid not in self.parent:
+      return set([uid])
+    return set(self.members[self._find(uid)])
+
+  def pairs(self):
+    """ Iterate over all (from, to) pairs in insertion order. """
+    for uidfrom in self.forward:
+      for uidto in self.forward[uidfrom]:
+        yield uidfrom, uidto
+
+  def __len__(self):
+    return sum(len(targets) for targets in self.forward.values())
+
+  def _find(self, uid):
+    if uid not in self.parent:
+      self.parent[uid] = uid
+      self.members[uid] = [uid]
+      return uid
+    root = uid
+    while self.parent[root] != root:
+      root = self.parent[root]
+    while self.parent[uid] != root:
+      self.parent[uid], uid = root, self.parent[uid]
+    return root
+
+  def _union(self, a, b):
+    ra, rb = self._find(a), self._find(b)
+    if ra == rb:
+      return
+    if len(self.members[ra]) < len(self.members[rb]):
+      ra, rb = rb, ra
+    self.parent[rb] = ra
+    self.members[ra].extend(self.members.pop(rb))
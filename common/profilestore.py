@@ -1,5 +1,12 @@
+import io
 import os
 import csv
+import mmap
+import fcntl
+import atexit
+import threading
+import contextlib
+from array import array
 
 try:
   import common.logger
@@ -9,94 +16,638 @@ except ImportError as ie:
   path.append(os.path.abspath('..'))
   import common.logger
 
+import common.matchgraph
+from common.storebase import BaseProfileStore
 
-class ProfileStore:
+
+class AppendLog:
+  """ An append-only CSV file. Rows are buffered and written out
+  in batches, each batch with a single write (where the OS takes it
+  whole) to a file opened in append mode, so that batches from several
+  processes do not interleave. A crash part way through a write can
+  still leave an incomplete last row; see repair().
+
+  A batch is written once it has `batch_size` rows, or `flush_interval`
+  seconds after its first row was buffered, by a timer thread if no
+  other write comes along. """
+
+  def __init__(self, filename, fieldnames, batch_size=100, flush_interval=5):
+    self.filename = filename
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    self.buffer = io.StringIO()
+    self.writer = csv.DictWriter(self.buffer, fieldnames)
+    self.count = 0
+    self.timer = None
+    self.lock = threading.RLock()
+    self.fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+  @staticmethod
+  def repair(filename, logger, chunk_size=64*1024):
+    """ Truncate a partially-written final row left by a crash, back
+    to the end of the last complete row. The file is read backwards
+    from its end only as far as that row. This is not itself safe
+    against other writers, so call it before any are writing (or
+    under the store's lock). """
+    if not os.path.exists(filename):
+      return
+    size = os.path.getsize(filename)
+    end = size
+    with open(filename, 'rb') as fh:
+      while end > 0:
+        start = max(0, end - chunk_size)
+        fh.seek(start)
+        newline = fh.read(end - start).rfind(b'\n')
+        if newline != -1:
+          end = start + newline + 1
+          break
+        end = start
+    if end < size:
+      logger.warn("Truncating {} bytes of incomplete row from `{}`.".format(size - end, filename))
+      os.truncate(filename, end)
+
+  def writerow(self, row):
+    with self.lock:
+      if self.fd is None:
+        raise ValueError("Cannot write to `{}`, it has been closed.".format(self.filename))
+      self.writer.writerow(row)
+      self.count += 1
+      if self.count >= self.batch_size:
+        self.flush()
+      elif self.timer is None:
+        self.timer = threading.Timer(self.flush_interval, self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+  def flush(self):
+    """ Write out any buffered rows. """
+    with self.lock:
+      if self.timer is not None:
+        self.timer.cancel()
+        self.timer = None
+      if self.count > 0 and self.fd is not None:
+        data = self.buffer.getvalue().encode('utf-8')
+        written = 0
+        while written < len(data):
+          written += os.write(self.fd, data[written:])
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.count = 0
+
+  def close(self):
+    with self.lock:
+      if self.fd is not None:
+        self.flush()
+        os.close(self.fd)
+        self.fd = None
+
+
+class Record:
+  """ A lightweight view onto one row of a ProfileStore, which
+  reads like a (read-only) record dict. """
+
+  __slots__ = ('store', 'row')
+
+  def __init__(self, store, row):
+    self.store = store
+    self.row = row
+
+  def __getitem__(self, key):
+    return self.store._field(self.row, key)
+
+  def get(self, key, default=None):
+    if key not in self.store.fieldnames:
+      return default
+    return self.store._field(self.row, key)
+
+  def keys(self):
+    return list(self.store.fieldnames)
+
+  def values(self):
+    return [self[key] for key in self.store.fieldnames]
+
+  def items(self):
+    return [(key, self[key]) for key in self.store.fieldnames]
+
+  def __iter__(self):
+    return iter(self.store.fieldnames)
+
+  def __len__(self):
+    return len(self.store.fieldnames)
+
+  def __contains__(self, key):
+    return key in self.store.fieldnames
+
+  def __eq__(self, other):
+    if not hasattr(other, 'items'):
+      return NotImplemented
+    return dict(self.items()) == dict(other.items())
+
+  def __repr__(self):
+    return repr(dict(self.items()))
+
+
+class RecordList:
+  """ A sequence of Record views over a set of rows of a
+  ProfileStore (all of them, if `rows` is None). """
+
+  __slots__ = ('store', 'rows')
+
+  def __init__(self, store, rows=None):
+    self.store = store
+    self.rows = rows
+
+  def __len__(self):
+    if self.rows is None:
+      return len(self.store.uids)
+    return len(self.rows)
+
+  def __getitem__(self, i):
+    if self.rows is None:
+      return Record(self.store, range(len(self.store.uids))[i])
+    return Record(self.store, self.rows[i])
+
+  def __iter__(self):
+    rows = range(len(self.store.uids)) if self.rows is None else self.rows
+    for row in rows:
+      yield Record(self.store, row)
+
+
+class LazyRecords:
+  """ A read-only sequence over the rows of a CSV store, which
+  memory-maps the file and decodes each row only when it is accessed.
+  The byte offset of every row is cached in `<filename>.idx`, along
+  with the size and modification time of the CSV it was built from.
+  The cache is extended rather than rebuilt when the CSV has only
+  been appended to. """
+
+  #Marks an index file with a (size, mtime) header.
+  index_magic = -2
+
+  def __init__(self, filename, fieldnames, logger):
+    self.fieldnames = fieldnames
+    self.logger = logger
+    self.fh = open(filename, 'rb')
+    stat = os.fstat(self.fh.fileno())
+    self.size = stat.st_size
+    self.mtime = stat.st_mtime_ns
+    self.map = b''
+    if self.size > 0:
+      self.map = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+    self.offsets = self._load_offsets(filename+'.idx')
+
+  def _load_offsets(self, idxfile):
+    offsets = array('q')
+    indexed = 0
+    if os.path.exists(idxfile):
+      data = open(idxfile, 'rb').read()
+      if len(data) >= 24:
+        magic, size, mtime = array('q', data[:24])
+        unchanged = (size, mtime) == (self.size, self.mtime)
+        #Or only appended to since, after a complete row.
+        appended = 0 < size < self.size and self.map[size-1:size] == b'\n'
+        if magic == self.index_magic and (unchanged or appended):
+          indexed = size
+          offsets.frombytes(data[24:24+(len(data)-24)//8*8])
+    if indexed < self.size:
+      self.logger.info("Indexing rows from byte {} of {}.".format(indexed, self.size))
+      pos = indexed
+      def lines():
+        nonlocal pos
+        while pos < self.size:
+          end = self.map.find(b'\n', pos)
+          end = self.size if end == -1 else end + 1
+          line = self.map[pos:end]
+          pos = end
+          yield line.decode('utf-8')
+      #The reader takes as many lines as a row spans (quoted fields may
+      #hold newlines), so `pos` is at the end of each row it returns.
+      start = pos
+      for row in csv.reader(lines()):
+        offsets.append(start)
+        start = pos
+      tmpfile = idxfile+'.tmp'
+      with open(tmpfile, 'wb') as fh:
+        fh.write(array('q', [self.index_magic, self.size, self.mtime]).tobytes())
+        fh.write(offsets.tobytes())
+      os.replace(tmpfile, idxfile)
+    return offsets
+
+  def __len__(self):
+    return len(self.offsets)
+
+  def __getitem__(self, i):
+    i = range(len(self.offsets))[i]
+    start = self.offsets[i]
+    end = self.offsets[i+1] if i+1 < len(self.offsets) else self.size
+    line = self.map[start:end].decode('utf-8')
+    return dict(zip(self.fieldnames, next(csv.reader([line]))))
+
+  def __iter__(self):
+    for i in range(len(self.offsets)):
+      yield self[i]
+
+  def close(self):
+    if self.map:
+      self.map.close()
+    self.fh.close()
+
+
+class ProfileStore(BaseProfileStore):
+  """ The central record of profiles found by searches, and the
+  matches between them. Records are held column-wise: uids in an
+  array, networks, URL prefixes and search terms as codes into
+  string tables. They are read through Record views. """
   
-  fieldnames = ['uid','network','network_id','url','search_term']
-  matchfieldnames = ['from','to']
+  statusfieldnames = ['uid','stage']
   
 
-  def __init__(self, filename, logger=None):
+  def __init__(self, filename, logger=None, batch_size=100, flush_interval=5, lazy=False, shared=False):
+    """ Open (or create) a CSV ProfileStore.
+
+    :param str filename: The CSV file holding records. Matches are kept in `matches-<filename>`, and pipeline progress in `status-<filename>`.
+    :param int batch_size: The number of rows to buffer before writing them out.
+    :param float flush_interval: The longest time, in seconds, to hold buffered rows.
+    :param bool lazy: If set, records are read on demand from a memory map of the file, and only decoded into the store's columns when an index is needed (e.g. by add_record). Matches and pipeline status are read when first used.
+    :param bool shared: If set, the store may be written by several processes at once. Each write takes an advisory lock on `<filename>.writelock`, reads in rows other processes have appended, and is written out before the lock is released. Otherwise the store keeps other processes from writing to it until it is closed (by a lock on `<filename>.lock`), and is opened shared instead if other shared stores have it open. Either raises ValueError if the file is already open unshared elsewhere. """
+    self.filename = filename
     self.matchfile = 'matches-'+filename
-    self.records = []
-    self.matches = {}
+    self.statusfile = 'status-'+filename
+    self.uids = array('q')
+    self.network_codes = array('H')
+    self.network_ids = []
+    self.url_prefix_codes = array('I')
+    self.url_suffixes = []
+    self.term_codes = array('I')
+    self.strings = {'network':[], 'url':[], 'search_term':[]}
+    self.string_codes = {'network':{}, 'url':{}, 'search_term':{}}
+    self.records = RecordList(self)
+    self.lazy_records = None
+    self.index = {}
+    self.uid_index = {}
+    self.network_index = {}
+    self.term_index = {}
+    self.done = dict((stage, set()) for stage in self.stages)
+    self.pending_index = dict((stage, {}) for stage in self.stages)
+    self.graph = common.matchgraph.MatchGraph()
+    self.matches = self.graph.forward
     self.curuid = 0
+    self.lockfh = None
+    self.holdfh = None
+    self.lockdepth = 0
+    self.offsets = {}
+    #Files a lazy store has yet to read.
+    self.unread = set()
     if not logger:
       logger = common.logger.getLogger('profile_store')
     self.logger = logger
-    if os.path.exists(filename):
+    #Held while the store is open: exclusively by a sole writer, or
+    #jointly by shared stores, so the two kinds cannot write at once.
+    self.holdfh = open(filename+'.lock','a')
+    if not shared:
+      try:
+        fcntl.flock(self.holdfh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except BlockingIOError:
+        self.logger.warn("`{}` is shared by other processes; opening it shared.".format(filename))
+        shared = True
+    if shared:
+      try:
+        fcntl.flock(self.holdfh, fcntl.LOCK_SH | fcntl.LOCK_NB)
+      except BlockingIOError:
+        self.holdfh.close()
+        raise ValueError("Cannot open `{}`, another process is writing to it.".format(filename))
+      self.lockfh = open(filename+'.writelock','a')
+      fcntl.flock(self.lockfh, fcntl.LOCK_EX)
+    self.shared = shared
+    AppendLog.repair(filename, logger)
+    AppendLog.repair(self.matchfile, logger)
+    AppendLog.repair(self.statusfile, logger)
+    if lazy:
+      self.unread.update([self.statusfile, self.matchfile])
+    elif os.path.exists(self.statusfile):
+      reader = csv.DictReader(open(self.statusfile,'r'),self.statusfieldnames)
+      for row in reader:
+        self._mark(row['uid'], row['stage'])
+    if os.path.exists(filename) and lazy:
+      self.lazy_records = LazyRecords(filename, self.fieldnames, logger)
+      self.records = self.lazy_records
+      if len(self.lazy_records) > 0:
+        self.curuid = int(self.lazy_records[-1]['uid'])
+    elif os.path.exists(filename):
       reader = csv.DictReader(open(filename,'r'),self.fieldnames)
       for row in reader:
-        self.records.append(row)
+        self._index_record(row)
         self.curuid = int(row['uid'])
-    if os.path.exists(self.matchfile):
+      self.logger.info("Loaded {} records in {} networks.".format(len(self.uids), len(self.strings['network'])))
+    if os.path.exists(self.matchfile) and not lazy:
       reader = csv.DictReader(open(self.matchfile,'r'),self.matchfieldnames)
       for row in reader:
-        uidfrom = row['from']
-        uidto = row['to']
-        if uidfrom not in self.matches:
-           self.matches[uidfrom] = []
-        if uidto not in self.matches[uidfrom]:
-            self.matches[uidfrom].append(uidto)
-    self.outputwriter = csv.DictWriter(open(filename,'a'),self.fieldnames)
-    self.matchoutputwriter = csv.DictWriter(open(self.matchfile,'a'),self.matchfieldnames)
+        self.graph.add(row['from'], row['to'])
+    if shared:
+      self._sync_offsets()
+      fcntl.flock(self.lockfh, fcntl.LOCK_UN)
+    self.outputwriter = AppendLog(filename, self.fieldnames, batch_size, flush_interval)
+    self.matchoutputwriter = AppendLog(self.matchfile, self.matchfieldnames, batch_size, flush_interval)
+    self.statusoutputwriter = AppendLog(self.statusfile, self.statusfieldnames, batch_size, flush_interval)
+    atexit.register(self.close)
     self.logger.info("Initialised ProfileStore, curid={}".format(self.curuid))
      
 
+  def flush(self):
+    """ Write out any buffered records, matches and status rows. """
+    self.outputwriter.flush()
+    self.matchoutputwriter.flush()
+    self.statusoutputwriter.flush()
+
+  def close(self):
+    """ Write out buffered rows and close the store's files. """
+    self.outputwriter.close()
+    self.matchoutputwriter.close()
+    self.statusoutputwriter.close()
+    if self.lazy_records:
+      self.lazy_records.close()
+      self.lazy_records = None
+    if self.lockfh:
+      self.lockfh.close()
+      self.lockfh = None
+    if self.holdfh:
+      self.holdfh.close()
+      self.holdfh = None
+
+  @contextlib.contextmanager
+  def locked(self):
+    """ Hold the store's advisory lock for a write (shared stores
+    only). Rows appended by other processes are read in first, and
+    the write is flushed before the lock is released. Nested uses
+    hold the lock until the outermost one ends, so a batch of writes
+    can be made under one lock. """
+    if not self.shared or self.lockdepth:
+      yield
+      return
+    fcntl.flock(self.lockfh, fcntl.LOCK_EX)
+    self.lockdepth += 1
+    try:
+      self._catch_up()
+      yield
+      self.flush()
+      self._sync_offsets()
+    finally:
+      self.lockdepth -= 1
+      fcntl.flock(self.lockfh, fcntl.LOCK_UN)
+
+  def _sync_offsets(self):
+    for filename in [self.filename, self.matchfile, self.statusfile]:
+      if filename in self.unread:
+        continue
+      self.offsets[filename] = os.path.getsize(filename) if os.path.exists(filename) else 0
+
+  def _read_new(self, filename, fieldnames):
+    """ Return the complete rows appended to a file since it was last read. """
+    offset = self.offsets.get(filename, 0)
+    if not os.path.exists(filename) or os.path.getsize(filename) <= offset:
+      return []
+    with open(filename,'rb') as fh:
+      fh.seek(offset)
+      data = fh.read()
+    end = data.rfind(b'\n') + 1
+    self.offsets[filename] = offset + end
+    return csv.DictReader(io.StringIO(data[:end].decode('utf-8')), fieldnames)
+
+  def _catch_up(self):
+    """ Read in rows appended to the store's files by other processes. """
+    self.load()
+    for row in self._read_new(self.filename, self.fieldnames):
+      self._index_record(row)
+      self.curuid = max(self.curuid, int(row['uid']))
+    for row in self._read_new(self.matchfile, self.matchfieldnames):
+      self.graph.add(row['from'], row['to'])
+    for row in self._read_new(self.statusfile, self.statusfieldnames):
+      self._mark(row['uid'], row['stage'])
+
+  def _load_status(self):
+    """ Read the status file, if a lazy store has not yet. """
+    if self.statusfile in self.unread:
+      self.unread.remove(self.statusfile)
+      for row in self._read_new(self.statusfile, self.statusfieldnames):
+        self._mark(row['uid'], row['stage'])
+
+  def _load_matches(self):
+    """ Read the matches file, if a lazy store has not yet. """
+    if self.matchfile in self.unread:
+      self.unread.remove(self.matchfile)
+      for row in self._read_new(self.matchfile, self.matchfieldnames):
+        self.graph.add(row['from'], row['to'])
+
+  def load(self):
+    """ Decode a lazily-opened store into its columns and indexes,
+    and read its matches and status. Does nothing if the store is
+    already loaded. """
+    #Before the records, which are indexed by whether they are done.
+    self._load_status()
+    self._load_matches()
+    if not self.lazy_records:
+      return
+    lazy = self.lazy_records
+    self.lazy_records = None
+    for row in lazy:
+      self._index_record(row)
+    lazy.close()
+    self.records = RecordList(self)
+    self.logger.info("Loaded {} records in {} networks.".format(len(self.uids), len(self.strings['network'])))
+
   def add_match(self, uidfrom, uidto):
     """ Add a mapping between two recorded profiles. """
-    known_ids = 0
-    for r in self.records:
-      if r['uid'] in [uidfrom,uidto]:
-        known_ids += 1
-    if known_ids == 2:
-      if uidfrom not in self.matches:
-         self.matches[uidfrom] = []
-      if uidto not in self.matches[uidfrom]:
-          self.matches[uidfrom].append(uidto)
-          self.matchoutputwriter.writerow({'from':uidfrom, 'to':uidto})
+    self.load()
+    with self.locked():
+      known_ids = 0
+      for uid in set([int(uidfrom), int(uidto)]):
+        if uid in self.uid_index:
+          known_ids += 1
+      if known_ids == 2:
+        if self.graph.add(uidfrom, uidto):
+            self.matchoutputwriter.writerow({'from':uidfrom, 'to':uidto})
+        else:
+            self.logger.info("Pair ({}, {}) is not new, ignoring.".format(uidfrom, uidto))
       else:
-          self.logger.info("Pair ({}, {}) is not new, ignoring.".format(uidfrom, uidto))
-    else:
-      self.logger.warn("Submitted match ({},{}) had {} uids not on record.".format(uidfrom, uidto, 2-known_ids))
+        self.logger.warn("Submitted match ({},{}) had {} uids not on record.".format(uidfrom, uidto, 2-known_ids))
 
 
   def is_matched(self, uid):
     """ Check if a UID is a known match."""
-    if uid in self.matches:
-      return True
-    else:
-      for kid in self.matches:
-        if uid in self.matches[kid]:
-          return True
-    return False
+    self._load_matches()
+    return self.graph.is_matched(uid)
 
   def is_match(self, uidfrom, uidto):
-    if uidfrom in self.matches:
-      return uidto in self.matches[uidfrom]
-    elif uidto in self.matches:
-      return uidfrom in self.matches[uidto]
-    return False
+    """ Check if two UIDs are directly matched (in either direction). """
+    self._load_matches()
+    return self.graph.is_match(uidfrom, uidto)
+
+  def matches_of(self, uid):
+    """ Return the set of UIDs directly matched to a UID. """
+    self._load_matches()
+    return self.graph.matches_of(uid)
+
+  def component_of(self, uid):
+    """ Return the set of UIDs transitively matched to a UID. """
+    self._load_matches()
+    return self.graph.component_of(uid)
+
+  def pairs(self):
+    """ Iterate over all (from, to) match pairs. """
+    self._load_matches()
+    return self.graph.pairs()
     
 
   def add_record(self, record):
     """ Add a profile to the record. Checks is_new. 
     Returns the unique ID assigned to the record. """
-    match = self.get_match(record)
-    if not match:
-      self.curuid += 1
-      record['uid'] = self.curuid
-      self.records.append(record)
-      self.outputwriter.writerow(record)
-    else:
-      self.logger.info("Record `{}` is not new, ignoring.".format(record['network_id']))
-      return match['uid']
-    return self.curuid
+    self.load()
+    with self.locked():
+      match = self.get_match(record)
+      if not match:
+        self.curuid += 1
+        row = dict((f, record.get(f)) for f in self.fieldnames)
+        row['uid'] = self.curuid
+        self._index_record(row)
+        self.outputwriter.writerow(row)
+      else:
+        self.logger.info("Record `{}` is not new, ignoring.".format(record['network_id']))
+        return match['uid']
+      return self.curuid
 
 
   def get_match(self, record):
     """ Check an added record would be new. """
-    for rec in self.records:
-      if rec['network_id'] == record['network_id'] and rec['network'] == record['network']:
-        return rec
-    return None
+    self.load()
+    row = self.index.get((record['network'], record['network_id']))
+    return None if row is None else Record(self, row)
+
+
+  def get_record(self, uid):
+    """ Return the record with the given unique ID, or None. """
+    self.load()
+    row = self.uid_index.get(int(uid))
+    return None if row is None else Record(self, row)
+
+
+  def by_network(self, network):
+    """ Return the records from one network. """
+    if self.lazy_records:
+      return [r for r in self.lazy_records if r['network'] == network]
+    return RecordList(self, self.network_index.get(network, ()))
+
+
+  def by_search_term(self, search_term):
+    """ Return the records found by one search term. """
+    if self.lazy_records:
+      return [r for r in self.lazy_records if r['search_term'] == search_term]
+    code = self.string_codes['search_term'].get(search_term)
+    return RecordList(self, self.term_index.get(code, ()))
+
+
+  def mark_done(self, uid, stage):
+    """ Record that a pipeline stage (one of ProfileStore.stages)
+    has been completed for a UID. """
+    self._load_status()
+    with self.locked():
+      if self._mark(uid, stage):
+        self.statusoutputwriter.writerow({'uid':uid, 'stage':stage})
+
+
+  def is_done(self, uid, stage):
+    """ Check if a pipeline stage has been completed for a UID. """
+    self._load_status()
+    return int(uid) in self.done[stage]
+
+
+  def pending(self, stage, network=None):
+    """ Return the records which have not yet completed a stage,
+    optionally only those from one network. The list is a snapshot,
+    so the store can be updated while iterating over it. """
+    self.load()
+    waiting = self.pending_index[stage]
+    if network:
+      return [Record(self, row) for row in waiting.get(network, {}).values()]
+    return [Record(self, row) for net in waiting for row in waiting[net].values()]
+
+
+  def _intern(self, table, value):
+    """ Return the code for a string in one of the string tables,
+    adding it if necessary. """
+    codes = self.string_codes[table]
+    code = codes.get(value)
+    if code is None:
+      code = len(self.strings[table])
+      codes[value] = code
+      self.strings[table].append(value)
+    return code
+
+
+  def _field(self, row, key):
+    """ Decode one field of a stored row. """
+    if key == 'uid':
+      return str(self.uids[row])
+    elif key == 'network':
+      return self.strings['network'][self.network_codes[row]]
+    elif key == 'network_id':
+      return self.network_ids[row]
+    elif key == 'url':
+      suffix = self.url_suffixes[row]
+      if suffix is None:
+        return None
+      return self.strings['url'][self.url_prefix_codes[row]] + suffix
+    elif key == 'search_term':
+      return self.strings['search_term'][self.term_codes[row]]
+    raise KeyError(key)
+
+
+  def _index_record(self, record):
+    """ Append a record to the columns and enter it into the lookup indexes. """
+    row = len(self.uids)
+    uid = int(record['uid'])
+    network = record['network']
+    url = record['url']
+    prefix, suffix = '', url
+    if url:
+      cut = url.rfind('/') + 1
+      prefix, suffix = url[:cut], url[cut:]
+    network_code = self._intern('network', network)
+    term_code = self._intern('search_term', record['search_term'])
+    self.uids.append(uid)
+    self.network_codes.append(network_code)
+    self.network_ids.append(record['network_id'])
+    self.url_prefix_codes.append(self._intern('url', prefix))
+    self.url_suffixes.append(suffix)
+    self.term_codes.append(term_code)
+    self.index.setdefault((network, record['network_id']), row)
+    self.uid_index[uid] = row
+    self.network_index.setdefault(network, array('q')).append(row)
+    self.term_index.setdefault(term_code, array('q')).append(row)
+    for stage in self.stages:
+      if uid not in self.done[stage]:
+        self.pending_index[stage].setdefault(network, {})[uid] = row
+
+
+  def _mark(self, uid, stage):
+    """ Enter a completed stage into the status indexes.
+
+    :return: True if the stage was not already marked complete. """
+    uid = int(uid)
+    if uid in self.done[stage]:
+      return False
+    self.done[stage].add(uid)
+    row = self.uid_index.get(uid)
+    if row is not None:
+      self.pending_index[stage].get(self._field(row, 'network'), {}).pop(uid, None)
+    return True
+
+
+def open_store(filename, logger=None, lazy=False, shared=False):
+  """ Open the ProfileStore backend appropriate to a filename:
+  SQLite for `.sqlite` files, CSV otherwise. `lazy` is passed to
+  CSV stores (SQLite stores are always read on demand). A `shared`
+  SQLite store commits every write, leaving locking to SQLite. """
+  if filename.endswith('.sqlite'):
+    import common.sqlitestore
+    return common.sqlitestore.SQLiteProfileStore(filename, logger=logger, batch_size=1 if shared else 1000)
+  return ProfileStore(filename, logger=logger, lazy=lazy, shared=shared)
@@ -0,0 +1,66 @@
+import time
+import threading
+
+
+class TokenBucket:
+  """ A token bucket rate limiter. Tokens accrue at `rate` per second,
+  up to `capacity`, and each request spends one. Requests reserve
+  their token in advance, so concurrent callers are each given a
+  distinct time at which to go ahead, rather than all waking at once.
+  The bucket is thread-safe, so one can be shared by all the workers
+  using a credential. """
+
+  def __init__(self, rate, capacity=1):
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity
+    self.updated = time.monotonic()
+    self.blocked_until = 0
+    self.lock = threading.Lock()
+
+  @classmethod
+  def from_quota(cls, requests, seconds):
+    """ Create a bucket allowing `requests` requests in any window of
+    `seconds` seconds. """
+    return cls(requests/seconds, requests)
+
+  def _refill(self, now):
+    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+  def delay(self):
+    """ Return the seconds until a token will be free, without
+    reserving it. """
+    with self.lock:
+      now = time.monotonic()
+      self._refill(now)
+      wait = max(0, (1 - self.tokens) / self.rate)
+      return max(wait, self.blocked_until - now)
+
+  def reserve(self):
+    """ Reserve a token, returning the seconds to wait before using it. """
+    with self.lock:
+      now = time.monotonic()
+      self._refill(now)
+      blocked = max(0, self.blocked_until - now)
+      if blocked:
+        #The window reset replenishes the budget; queue behind it.
+        self.tokens = min(self.tokens, 0)
+      self.tokens -= 1
+      return max(blocked, -self.tokens / self.rate if self.tokens < 0 else 0)
+
+  def update(self, remaining, reset=None):
+    """ Correct the bucket from a server's report of its budget.
+
+    :param int remaining: The requests left in the current window.
+    :param float reset: The epoch time at which the window resets, if known. """
+    with self.lock:
+      now = time.monotonic()
+      self._refill(now)
+      #Reservations already handed out are still owed.
+      owed = min(self.tokens, 0)
+      self.tokens = min(self.capacity, remaining) + owed
+      if reset is not None and remaining <= 0:
+        self.blocked_until = now + max(0, reset - time.time())
+      elif remaining > 0:
+        self.blocked_until = 0
@@ -0,0 +1,132 @@
+import os
+import csv
+import gzip
+import json
+import fcntl
+import threading
+
+
+class RawStore:
+  """ The RawStore holds the raw responses downloaded for each record.
+  Each record's bundles are written as one line of JSON, compressed as
+  a gzip member of its own and appended to the current segment file
+  (`segment-NNNNN.jsonl.gz`). The `index` file maps each uid to the
+  segment, offset and length of its member, so any record can be read
+  back without scanning. Concatenated members are themselves a valid
+  gzip file, so `zcat segment-*.jsonl.gz` yields the JSON lines.
+
+  Directories of `<uid>.json` files written by earlier versions can
+  still be read. """
+
+  indexfieldnames = ['uid','segment','offset','length']
+  segment_size = 64*1024*1024
+
+  def __init__(self, dirpath, logger=None):
+    self.dirpath = dirpath
+    self.logger = logger
+    os.makedirs(dirpath, exist_ok=True)
+    self.indexfile = os.path.join(dirpath, 'index')
+    self.index = {}
+    self.indexed = 0
+    self.segment = 0
+    self.lock = threading.Lock()
+    self._catch_up()
+
+  def _segment_path(self, segment):
+    return os.path.join(self.dirpath, 'segment-{:05d}.jsonl.gz'.format(segment))
+
+  def _legacy_path(self, uid):
+    return os.path.join(self.dirpath, str(uid)+'.json')
+
+  def _catch_up(self):
+    """ Read index entries appended since the index was last read,
+    including those written by other processes. """
+    try:
+      if os.path.getsize(self.indexfile) == self.indexed:
+        #Nothing appended; the index is only ever appended to.
+        return
+    except FileNotFoundError:
+      return
+    with open(self.indexfile, 'r', newline='') as fh:
+      fh.seek(self.indexed)
+      for line in iter(fh.readline, ''):
+        if not line.endswith('\n'):
+          #Partly-written entry; read it next time.
+          break
+        self.indexed += len(line.encode('utf-8'))
+        row = next(csv.reader([line]))
+        self.index[row[0]] = (int(row[1]), int(row[2]), int(row[3]))
+        self.segment = max(self.segment, int(row[1]))
+
+  def __contains__(self, uid):
+    uid = str(uid)
+    if uid not in self.index:
+      self._catch_up()
+    return uid in self.index or os.path.exists(self._legacy_path(uid))
+
+  def uids(self):
+    """ Return the uids of all records held, as strings. """
+    self._catch_up()
+    legacy = [fn[:-5] for fn in os.listdir(self.dirpath) if fn.endswith('.json')]
+    return set(self.index).union(legacy)
+
+  def get(self, uid):
+    """ Return the bundles stored for a uid, or None if there are none. """
+    uid = str(uid)
+    if uid not in self.index:
+      self._catch_up()
+    if uid in self.index:
+      segment, offset, length = self.index[uid]
+      with open(self._segment_path(segment), 'rb') as fh:
+        fh.seek(offset)
+        data = fh.read(length)
+      return json.loads(gzip.decompress(data).decode('utf-8'))
+    if os.path.exists(self._legacy_path(uid)):
+      with open(self._legacy_path(uid), 'r') as fh:
+        return json.load(fh)
+    return None
+
+  def put(self, uid, bundles):
+    """ Store the bundles for a uid, replacing any stored before. """
+    data = gzip.compress((json.dumps(bundles)+'\n').encode('utf-8'))
+    self.write(uid, data)
+
+  def put_stream(self, uid, bundles):
+    """ Store the bundles for a uid as put(), where `bundles` is an
+    iterable of bundles already serialised as JSON. They are compressed
+    as they are read, so need not all be held in memory at once. """
+    def writer(fh):
+      with gzip.GzipFile(fileobj=fh, mode='wb') as gz:
+        gz.write(b'[')
+        for i, bundle in enumerate(bundles):
+          if i:
+            gz.write(b', ')
+          gz.write(bundle.encode('utf-8'))
+        gz.write(b']\n')
+    self._append(uid, writer, 0)
+
+  def write(self, uid, data):
+    """ Append an already-compressed gzip member for a uid. Safe to call
+    from several threads and processes at once. """
+    self._append(uid, lambda fh: fh.write(data), len(data))
+
+  def _append(self, uid, writer, size):
+    """ Append a gzip member to the current segment, using `writer(fh)`,
+    and index it. `size` is the expected length of the member. """
+    with self.lock, open(self.indexfile, 'a', newline='') as indexfh:
+      fcntl.flock(indexfh, fcntl.LOCK_EX)
+      try:
+        self._catch_up()
+        path = self._segment_path(self.segment)
+        if os.path.exists(path) and os.path.getsize(path) + size > self.segment_size:
+          self.segment += 1
+          path = self._segment_path(self.segment)
+        with open(path, 'ab') as fh:
+          offset = fh.tell()
+          writer(fh)
+          length = fh.tell() - offset
+        csv.writer(indexfh, lineterminator='\n').writerow([str(uid), self.segment, offset, length])
+        indexfh.flush()
+        self._catch_up()
+      finally:
+        fcntl.flock(indexfh, fcntl.LOCK_UN)
@@ -0,0 +1,130 @@
+import os
+import gzip
+import time
+import hashlib
+import threading
+from urllib.parse import urlencode
+from collections import OrderedDict
+
+
+class ResponseCache:
+  """ An on-disk cache of API responses. Each response is stored
+  gzipped under the sha256 of its URL and parameters, with any
+  credentials removed from the parameters first, so that the same
+  query made with different keys is cached once.
+
+  Entries expire after the TTL of the first pattern in `ttls` found
+  in their URL, or after `default_ttl` seconds. Once the cache holds
+  more than `max_bytes`, the least recently used entries are removed. """
+
+  credential_params = ['key','access_token','client_secret','fb_exchange_token']
+  credential_prefixes = ['oauth_']
+  default_ttl = 7*24*3600
+  ttls = {'/statuses/user_timeline': 24*3600,
+          '/activities/public': 24*3600,
+          '/search': 3600}
+
+  def __init__(self, dirpath, max_bytes=1024*1024*1024, ttls=None, default_ttl=None, logger=None):
+    self.dirpath = dirpath
+    self.max_bytes = max_bytes
+    self.logger = logger
+    if ttls is not None:
+      self.ttls = ttls
+    if default_ttl is not None:
+      self.default_ttl = default_ttl
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+    os.makedirs(dirpath, exist_ok=True)
+    #key -> size, least recently used first.
+    self.entries = OrderedDict()
+    self.size = 0
+    found = []
+    for shard in os.listdir(dirpath):
+      shardpath = os.path.join(dirpath, shard)
+      if not os.path.isdir(shardpath):
+        continue
+      for fn in os.listdir(shardpath):
+        if not fn.endswith('.gz'):
+          continue
+        st = os.stat(os.path.join(shardpath, fn))
+        found.append((st.st_atime, fn[:-3], st.st_size))
+    for atime, key, size in sorted(found):
+      self.entries[key] = size
+      self.size += size
+
+  @classmethod
+  def key(cls, url, params):
+    """ Return the cache key for a query. """
+    params = sorted((k, str(v)) for k, v in params.items()
+                    if k not in cls.credential_params
+                    and not any(k.startswith(p) for p in cls.credential_prefixes))
+    return hashlib.sha256((url+'?'+urlencode(params)).encode('utf-8')).hexdigest()
+
+  def ttl(self, url):
+    for pattern in self.ttls:
+      if pattern in url:
+        return self.ttls[pattern]
+    return self.default_ttl
+
+  def _path(self, key):
+    return os.path.join(self.dirpath, key[:2], key+'.gz')
+
+  def get(self, key, url):
+    """ Return the cached response text for a key, or None if there is
+    no fresh entry. `url` is used to find the TTL. """
+    path = self._path(key)
+    try:
+      st = os.stat(path)
+      if time.time() - st.st_mtime > self.ttl(url):
+        self._remove(key)
+      else:
+        with open(path, 'rb') as fh:
+          text = gzip.decompress(fh.read()).decode('utf-8')
+        #Record the access for LRU ordering, leaving the stored time alone.
+        os.utime(path, (time.time(), st.st_mtime))
+        with self.lock:
+          if key in self.entries:
+            self.entries.move_to_end(key)
+          self.hits += 1
+        return text
+    except (OSError, EOFError):
+      pass
+    with self.lock:
+      self.misses += 1
+    return None
+
+  def put(self, key, text):
+    """ Store the response text for a key. """
+    data = gzip.compress(text.encode('utf-8'))
+    path = self._path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    #Write then rename, so readers never see a partial entry.
+    tmppath = '{}.{}.{}'.format(path, os.getpid(), threading.get_ident())
+    with open(tmppath, 'wb') as fh:
+      fh.write(data)
+    os.replace(tmppath, path)
+    with self.lock:
+      self.size += len(data) - self.entries.pop(key, 0)
+      self.entries[key] = len(data)
+      while self.size > self.max_bytes and len(self.entries) > 1:
+        oldkey, oldsize = self.entries.popitem(last=False)
+        self.size -= oldsize
+        try:
+          os.remove(self._path(oldkey))
+        except OSError:
+          pass
+
+  def _remove(self, key):
+    with self.lock:
+      self.size -= self.entries.pop(key, 0)
+    try:
+      os.remove(self._path(key))
+    except OSError:
+      pass
+
+  def stats(self):
+    """ Return a summary of cache use. """
+    total = self.hits + self.misses
+    rate = self.hits / total if total else 0
+    return "{} hits, {} misses ({:.0%} hit rate), {} entries, {} bytes".format(self.hits, self.misses, rate, len(self.entries), self.size)
@@ -0,0 +1,241 @@
+import os
+import atexit
+import sqlite3
+import contextlib
+
+try:
+  import common.logger
+except ImportError as ie:
+  from sys import path
+  path.append(os.path.abspath('.'))
+  path.append(os.path.abspath('..'))
+  import common.logger
+
+from common.storebase import BaseProfileStore
+
+
+class RecordView:
+  """ An iterable over the records of an SQLite store, which
+  queries the database afresh each time it is iterated. Rows are
+  returned as dicts in the same shape as ProfileStore records. """
+
+  def __init__(self, store, where='', args=()):
+    self.store = store
+    self.where = where
+    self.args = args
+
+  def __iter__(self):
+    query = 'SELECT uid, network, network_id, url, search_term FROM records {} ORDER BY uid'.format(self.where)
+    for row in self.store.db.execute(query, self.args):
+      yield self.store._to_record(row)
+
+  def __len__(self):
+    query = 'SELECT COUNT(*) FROM records {}'.format(self.where)
+    return self.store.db.execute(query, self.args).fetchone()[0]
+
+
+class SQLiteProfileStore(BaseProfileStore):
+  """ A ProfileStore with the same interface as the CSV-backed
+  one, but kept in an indexed SQLite file. Writes are grouped
+  into transactions of `batch_size` statements. """
+
+  schema = ["CREATE TABLE IF NOT EXISTS records (uid INTEGER PRIMARY KEY, network TEXT, network_id TEXT, url TEXT, search_term TEXT)",
+            "CREATE INDEX IF NOT EXISTS records_term ON records (search_term)",
+            "CREATE TABLE IF NOT EXISTS matches (uidfrom TEXT, uidto TEXT, PRIMARY KEY (uidfrom, uidto))",
+            "CREATE INDEX IF NOT EXISTS matches_to ON matches (uidto)",
+            "CREATE TABLE IF NOT EXISTS status (uid INTEGER, stage TEXT, PRIMARY KEY (uid, stage))"]
+
+  def __init__(self, filename, logger=None, batch_size=1000):
+    if not logger:
+      logger = common.logger.getLogger('profile_store')
+    self.logger = logger
+    self.filename = filename
+    self.batch_size = batch_size
+    self.uncommitted = 0
+    self.lockdepth = 0
+    self.db = sqlite3.connect(filename, timeout=60)
+    for statement in self.schema:
+      self.db.execute(statement)
+    try:
+      #Replaces the plain records_net_id index of earlier versions.
+      self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS records_network_id ON records (network, network_id)")
+      self.db.execute("DROP INDEX IF EXISTS records_net_id")
+    except sqlite3.IntegrityError:
+      self.logger.warn("{} holds duplicate records; they will not be prevented.".format(filename))
+      self.db.execute("CREATE INDEX IF NOT EXISTS records_net_id ON records (network, network_id)")
+    self.db.commit()
+    maxuid = self.db.execute('SELECT MAX(uid) FROM records').fetchone()[0]
+    self.curuid = maxuid if maxuid else 0
+    self.records = RecordView(self)
+    atexit.register(self.close)
+    self.logger.info("Initialised SQLiteProfileStore, curid={}".format(self.curuid))
+
+  def _to_record(self, row):
+    record = dict(zip(self.fieldnames, row))
+    record['uid'] = str(record['uid'])
+    return record
+
+  def _written(self, count=1):
+    self.uncommitted += count
+    if self.uncommitted >= self.batch_size and not self.lockdepth:
+      self.flush()
+
+  def flush(self):
+    """ Commit any outstanding writes. """
+    if self.db:
+      self.db.commit()
+    self.uncommitted = 0
+
+  def close(self):
+    """ Commit outstanding writes and close the database. """
+    if self.db:
+      self.flush()
+      self.db.close()
+      self.db = None
+
+  @contextlib.contextmanager
+  def locked(self):
+    """ Make a batch of writes in one transaction, begun immediately
+    so that other processes' writes wait for it rather than interleave.
+    Nested uses join the outermost. The transaction is committed with
+    the batch it falls in, as other writes are (at once, if nothing
+    was written). """
+    if self.lockdepth:
+      yield
+      return
+    if not self.db.in_transaction:
+      self.db.execute('BEGIN IMMEDIATE')
+    self.lockdepth += 1
+    try:
+      yield
+    finally:
+      self.lockdepth -= 1
+    if not self.uncommitted or self.uncommitted >= self.batch_size:
+      self.flush()
+
+  def add_match(self, uidfrom, uidto):
+    """ Add a mapping between two recorded profiles. """
+    known_ids = 0
+    for uid in set([str(uidfrom), str(uidto)]):
+      if self.get_record(uid):
+        known_ids += 1
+    if known_ids == 2:
+      if not self.db.execute('SELECT 1 FROM matches WHERE uidfrom = ? AND uidto = ?', (str(uidfrom), str(uidto))).fetchone():
+        self.db.execute('INSERT INTO matches VALUES (?, ?)', (str(uidfrom), str(uidto)))
+        self._written()
+      else:
+        self.logger.info("Pair ({}, {}) is not new, ignoring.".format(uidfrom, uidto))
+    else:
+      self.logger.warn("Submitted match ({},{}) had {} uids not on record.".format(uidfrom, uidto, 2-known_ids))
+
+  def is_matched(self, uid):
+    """ Check if a UID is a known match."""
+    uid = str(uid)
+    return self.db.execute('SELECT 1 FROM matches WHERE uidfrom = ? OR uidto = ? LIMIT 1', (uid, uid)).fetchone() is not None
+
+  def is_match(self, uidfrom, uidto):
+    """ Check if two UIDs are directly matched (in either direction). """
+    a, b = str(uidfrom), str(uidto)
+    return self.db.execute('SELECT 1 FROM matches WHERE (uidfrom = ? AND uidto = ?) OR (uidfrom = ? AND uidto = ?)', (a, b, b, a)).fetchone() is not None
+
+  def matches_of(self, uid):
+    """ Return the set of UIDs directly matched to a UID. """
+    uid = str(uid)
+    rows = self.db.execute('SELECT uidto FROM matches WHERE uidfrom = ? UNION SELECT uidfrom FROM matches WHERE uidto = ?', (uid, uid))
+    return set(row[0] for row in rows)
+
+  def component_of(self, uid):
+    """ Return the set of UIDs transitively matched to a UID. """
+    seen = set([str(uid)])
+    frontier = [str(uid)]
+    while frontier:
+      uid = frontier.pop()
+      for other in self.matches_of(uid):
+        if other not in seen:
+          seen.add(other)
+          frontier.append(other)
+    return seen
+
+  def pairs(self):
+    """ Iterate over all (from, to) match pairs. """
+    return iter(self.db.execute('SELECT uidfrom, uidto FROM matches ORDER BY rowid').fetchall())
+
+  def add_record(self, record):
+    """ Add a profile to the record. Checks is_new.
+    Returns the unique ID assigned to the record. """
+    match = self.get_match(record)
+    if not match:
+      #Let SQLite allocate the uid, so that processes sharing the file cannot
+      #collide, and the unique index decide whether the record is new.
+      cursor = self.db.execute('INSERT OR IGNORE INTO records VALUES (NULL, ?, ?, ?, ?)', [record.get(f) for f in self.fieldnames[1:]])
+      if cursor.rowcount:
+        self.curuid = cursor.lastrowid
+        self._written()
+        return self.curuid
+      #Added by another process since get_match().
+      match = self.get_match(record)
+    self.logger.info("Record `{}` is not new, ignoring.".format(record['network_id']))
+    return match['uid']
+
+  def insert_records(self, records):
+    """ Insert records verbatim, keeping their existing uids. Used
+    when converting from another store. """
+    rows = [[record.get(f) for f in self.fieldnames] for record in records]
+    self.db.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?)', rows)
+    maxuid = self.db.execute('SELECT MAX(uid) FROM records').fetchone()[0]
+    self.curuid = maxuid if maxuid else 0
+    self._written(len(rows))
+
+  def insert_matches(self, pairs):
+    """ Insert (from, to) match pairs verbatim. """
+    rows = [(str(uidfrom), str(uidto)) for uidfrom, uidto in pairs]
+    self.db.executemany('INSERT OR IGNORE INTO matches VALUES (?, ?)', rows)
+    self._written(len(rows))
+
+  def insert_status(self, rows):
+    """ Insert (uid, stage) completion rows verbatim. """
+    rows = [(int(uid), stage) for uid, stage in rows]
+    self.db.executemany('INSERT OR IGNORE INTO status VALUES (?, ?)', rows)
+    self._written(len(rows))
+
+  def status_rows(self):
+    """ Iterate over all (uid, stage) completion rows. """
+    return iter(self.db.execute('SELECT uid, stage FROM status ORDER BY rowid').fetchall())
+
+  def get_match(self, record):
+    """ Check an added record would be new. """
+    row = self.db.execute('SELECT uid, network, network_id, url, search_term FROM records WHERE network = ? AND network_id = ? ORDER BY uid LIMIT 1', (record['network'], record['network_id'])).fetchone()
+    return self._to_record(row) if row else None
+
+  def get_record(self, uid):
+    """ Return the record with the given unique ID, or None. """
+    row = self.db.execute('SELECT uid, network, network_id, url, search_term FROM records WHERE uid = ?', (int(uid),)).fetchone()
+    return self._to_record(row) if row else None
+
+  def by_network(self, network):
+    """ Return the records from one network. """
+    return RecordView(self, 'WHERE network = ?', (network,))
+
+  def by_search_term(self, search_term):
+    """ Return the records found by one search term. """
+    return RecordView(self, 'WHERE search_term = ?', (search_term,))
+
+  def mark_done(self, uid, stage):
+    """ Record that a pipeline stage (one of SQLiteProfileStore.stages)
+    has been completed for a UID. """
+    self.db.execute('INSERT OR IGNORE INTO status VALUES (?, ?)', (int(uid), stage))
+    self._written()
+
+  def is_done(self, uid, stage):
+    """ Check if a pipeline stage has been completed for a UID. """
+    return self.db.execute('SELECT 1 FROM status WHERE uid = ? AND stage = ?', (int(uid), stage)).fetchone() is not None
+
+  def pending(self, stage, network=None):
+    """ Return the records which have not yet completed a stage,
+    optionally only those from one network, as a snapshot list. """
+    where = 'WHERE uid NOT IN (SELECT uid FROM status WHERE stage = ?)'
+    args = (stage,)
+    if network:
+      where += ' AND network = ?'
+      args += (network,)
+    return list(RecordView(self, where, args))
@@ -0,0 +1,99 @@
+import abc
+import contextlib
+
+
+class BaseProfileStore(abc.ABC):
+  """ The interface shared by the ProfileStore backends (CSV and
+  SQLite; see common.profilestore.open_store). Records are dicts, or
+  read like them, with the fields in `fieldnames`; uids are returned
+  as strings. A backend missing any of these methods cannot be
+  instantiated. """
+
+  fieldnames = ['uid','network','network_id','url','search_term']
+  matchfieldnames = ['from','to']
+  stages = ['downloaded','analysed']
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  @abc.abstractmethod
+  def flush(self):
+    """ Write out any buffered writes. """
+
+  @abc.abstractmethod
+  def close(self):
+    """ Write out buffered writes and close the store. """
+
+  @abc.abstractmethod
+  @contextlib.contextmanager
+  def locked(self):
+    """ Make a batch of writes as one, excluding other processes
+    sharing the store. Nested uses join the outermost. """
+
+  def load(self):
+    """ Read a store opened lazily into memory, where it has to be. """
+
+  @abc.abstractmethod
+  def add_record(self, record):
+    """ Add a profile to the record, unless one from the same network
+    with the same network_id is there already.
+
+    :return: The uid of the record, new or existing. """
+
+  @abc.abstractmethod
+  def get_match(self, record):
+    """ Return the stored record with the network and network_id of
+    `record`, or None. """
+
+  @abc.abstractmethod
+  def get_record(self, uid):
+    """ Return the record with the given unique ID, or None. """
+
+  @abc.abstractmethod
+  def by_network(self, network):
+    """ Return the records from one network. """
+
+  @abc.abstractmethod
+  def by_search_term(self, search_term):
+    """ Return the records found by one search term. """
+
+  @abc.abstractmethod
+  def add_match(self, uidfrom, uidto):
+    """ Add a mapping between two recorded profiles. """
+
+  @abc.abstractmethod
+  def is_matched(self, uid):
+    """ Check if a UID is a known match. """
+
+  @abc.abstractmethod
+  def is_match(self, uidfrom, uidto):
+    """ Check if two UIDs are directly matched (in either direction). """
+
+  @abc.abstractmethod
+  def matches_of(self, uid):
+    """ Return the set of UIDs directly matched to a UID. """
+
+  @abc.abstractmethod
+  def component_of(self, uid):
+    """ Return the set of UIDs transitively matched to a UID. """
+
+  @abc.abstractmethod
+  def pairs(self):
+    """ Iterate over all (from, to) match pairs. """
+
+  @abc.abstractmethod
+  def mark_done(self, uid, stage):
+    """ Record that a pipeline stage (one of `stages`) has been
+    completed for a UID. """
+
+  @abc.abstractmethod
+  def is_done(self, uid, stage):
+    """ Check if a pipeline stage has been completed for a UID. """
+
+  @abc.abstractmethod
+  def pending(self, stage, network=None):
+    """ Return the records which have not yet completed a stage,
+    optionally only those from one network, as a snapshot. """
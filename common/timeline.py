@@ -0,0 +1,178 @@
+import time
+import array
+import calendar
+
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+def seconds(t):
+  """ Convert a time to whole seconds since the epoch. struct_times,
+  time tuples and datetimes are read as UTC, so that their fields, such as the
+  hour of the day, are kept exactly as the network reported them. """
+  if isinstance(t, (int, float)):
+    return int(t)
+  if hasattr(t, 'timetuple'):
+    t = t.timetuple()
+  return calendar.timegm(tuple(t)[:6] + (0, 0, 0))
+
+
+class Timeline:
+  """ The times of a profile's activity, held as parallel arrays: the
+  time of each event in seconds since the epoch, a code for its kind
+  (one of the Content types, ACTIVITY, or PLACE) and the index of its
+  location in a table of the distinct locations seen (or -1).
+
+  Hour-of-day binning and time-window queries work on whole arrays,
+  and use numpy where it is installed. """
+
+  ACTIVITY = 0 #An activity of no particular kind.
+  PLACE = -1   #A location report, which is not itself an activity.
+
+  pickle_version = 1
+  __slots__ = ('times', 'kinds', 'places', 'locations', 'location_index')
+
+  def __init__(self):
+    self.times = array.array('q')
+    self.kinds = array.array('b')
+    self.places = array.array('i')
+    self.locations = []
+    self.location_index = {}
+
+  def __len__(self):
+    return len(self.times)
+
+  def __getstate__(self):
+    #Without locations, every place is -1; don't store them.
+    places = self.places.tobytes() if self.locations else b''
+    return (Timeline.pickle_version, self.times.tobytes(), self.kinds.tobytes(), places, self.locations)
+
+  def __setstate__(self, state):
+    version, times, kinds, places, locations = state
+    self.__init__()
+    self.times.frombytes(times)
+    self.kinds.frombytes(kinds)
+    if places:
+      self.places.frombytes(places)
+    else:
+      self.places.extend([-1] * len(self.times))
+    for location in locations:
+      self._intern(location)
+
+  def _intern(self, location):
+    """ Return the index of a Location in the location table, adding it
+    if no equal Location is there. """
+    if location is None:
+      return -1
+    key = (str(location.location), location.detailed)
+    if key not in self.location_index:
+      self.location_index[key] = len(self.locations)
+      self.locations.append(location)
+    return self.location_index[key]
+
+  def add(self, t, kind=ACTIVITY, location=None):
+    """ Record an event.
+
+    :param t: The time of the event, as a struct_time or epoch seconds.
+    :param int kind: One of the Content types, Timeline.ACTIVITY or Timeline.PLACE.
+    :param Location location: Where the event happened, if known. """
+    self.times.append(seconds(t))
+    self.kinds.append(kind)
+    self.places.append(self._intern(location))
+
+  def locate(self, t, location):
+    """ Record the location of the latest event at time `t` without one,
+    or add a PLACE event if there is none. """
+    secs = seconds(t)
+    for i in range(len(self.times)-1, -1, -1):
+      if self.times[i] == secs and self.places[i] < 0 and self.kinds[i] != Timeline.PLACE:
+        self.places[i] = self._intern(location)
+        return
+    self.add(secs, Timeline.PLACE, location)
+
+  def activity(self):
+    """ Return the times of the events which are activities, as an
+    int64 numpy array if numpy is installed, else an array('q'). """
+    if numpy is not None:
+      times = numpy.frombuffer(self.times, dtype=numpy.int64)
+      return times[numpy.frombuffer(self.kinds, dtype=numpy.int8) != Timeline.PLACE]
+    if Timeline.PLACE not in self.kinds:
+      return self.times
+    return array.array('q', [t for t, k in zip(self.times, self.kinds) if k != Timeline.PLACE])
+
+  def hour_histogram(self, hours=1):
+    """ Count the activities in each period of the day.
+
+    :param int hours: The length of each period, dividing 24.
+    :return: A list of 24/hours counts, the first from midnight. """
+    bins = 24 // hours
+    times = self.activity()
+    if numpy is not None:
+      return numpy.bincount(times // 3600 % 24 // hours, minlength=bins).tolist()
+    counts = [0] * bins
+    for t in times:
+      counts[t // 3600 % 24 // hours] += 1
+    return counts
+
+  def count_between(self, start, end):
+    """ Count the activities at or after `start` and before `end`,
+    either given as a struct_time or epoch seconds. """
+    start, end = seconds(start), seconds(end)
+    times = self.activity()
+    if numpy is not None:
+      return int(numpy.count_nonzero((times >= start) & (times < end)))
+    return sum(1 for t in times if start <= t < end)
+
+  def history(self):
+    """ Yield (time, Location) for each located event, time being epoch seconds. """
+    for t, place in zip(self.times, self.places):
+      if place >= 0:
+        yield t, self.locations[place]
+
+
+class ActivityTimes:
+  """ A list-like view of a Timeline's activity times as struct_times,
+  the form Profile.activity_timestamps has always had. """
+
+  __slots__ = ('timeline',)
+
+  def __init__(self, timeline):
+    self.timeline = timeline
+
+  def __len__(self):
+    return len(self.timeline.activity())
+
+  def __iter__(self):
+    return (time.gmtime(t) for t in self.timeline.activity())
+
+  def __getitem__(self, i):
+    return list(self)[i]
+
+  def append(self, t):
+    self.timeline.add(t)
+
+
+class LocationHistory:
+  """ A list-like view of a Timeline's located events as {struct_time:
+  Location} dicts, the form Profile.location_history has always had. """
+
+  __slots__ = ('timeline',)
+
+  def __init__(self, timeline):
+    self.timeline = timeline
+
+  def __len__(self):
+    return sum(1 for place in self.timeline.places if place >= 0)
+
+  def __iter__(self):
+    return ({time.gmtime(t): location} for t, location in self.timeline.history())
+
+  def __getitem__(self, i):
+    return list(self)[i]
+
+  def append(self, entry):
+    for t, location in entry.items():
+      self.timeline.locate(t, location)
@@ -0,0 +1,59 @@
+import argparse
+import csv
+import os
+import common.profilestore
+import common.sqlitestore
+import common.logger
+
+
+def csv_to_sqlite(infile, outfile, logger):
+  ps = common.profilestore.ProfileStore(infile, logger)
+  sps = common.sqlitestore.SQLiteProfileStore(outfile, logger)
+  sps.insert_records(ps.records)
+  sps.insert_matches(ps.pairs())
+  sps.insert_status((uid, stage) for stage in ps.stages for uid in ps.done[stage])
+  sps.close()
+  return len(ps.records)
+
+
+def sqlite_to_csv(infile, outfile, logger):
+  sps = common.sqlitestore.SQLiteProfileStore(infile, logger)
+  fh = open(outfile,'w')
+  writer = csv.DictWriter(fh, common.profilestore.ProfileStore.fieldnames)
+  count = 0
+  for record in sps.records:
+    writer.writerow(record)
+    count += 1
+  fh.close()
+  fh = open('matches-'+outfile,'w')
+  writer = csv.DictWriter(fh, common.profilestore.ProfileStore.matchfieldnames)
+  for uidfrom, uidto in sps.pairs():
+    writer.writerow({'from':uidfrom, 'to':uidto})
+  fh.close()
+  fh = open('status-'+outfile,'w')
+  writer = csv.DictWriter(fh, common.profilestore.ProfileStore.statusfieldnames)
+  for uid, stage in sps.status_rows():
+    writer.writerow({'uid':uid, 'stage':stage})
+  fh.close()
+  sps.close()
+  return count
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Convert a ProfileStore between CSV and SQLite (.sqlite) formats, keeping uids.')
+  parser.add_argument('infile', help='The existing ProfileStore.')
+  parser.add_argument('outfile', help='The ProfileStore to create. The direction of conversion is chosen from its extension.')
+  args = parser.parse_args()
+
+  logger = common.logger.getLogger('convert-store',output='convert.log',level='info')
+
+  if os.path.exists(args.outfile):
+    raise ValueError('Output store `{}` already exists.'.format(args.outfile))
+
+  if args.outfile.endswith('.sqlite') and not args.infile.endswith('.sqlite'):
+    count = csv_to_sqlite(args.infile, args.outfile, logger)
+  elif args.infile.endswith('.sqlite') and not args.outfile.endswith('.sqlite'):
+    count = sqlite_to_csv(args.infile, args.outfile, logger)
+  else:
+    raise ValueError('Exactly one of the input and output stores should be a .sqlite file.')
+  print('Converted {} records from `{}` to `{}`.'.format(count, args.infile, args.outfile))
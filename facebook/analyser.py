@@ -94,7 +94,7 @@ class FacebookAnalyser(common.analyser.Analyser):
       thetime = None
       if 'created_time' in l:
         thetime = time.strptime(l['created_time'],self.datestring)
-        profile.activity_timestamps.append(thetime)
+        profile.timeline.add(thetime, common.analyser.Content.LINKS)
       
       if 'message' in l:
         profile.content.append(common.analyser.Content(common.analyser.Content.TEXT,l['message'],thetime,None,None,opinion))
@@ -115,7 +115,7 @@ class FacebookAnalyser(common.analyser.Analyser):
         u = c['from']
         if 'message' in c and u['id'] == profile.uid:
           thetime = time.strptime(c['created_time'],self.datestring)
-          profile.activity_timestamps.append(thetime)
+          profile.timeline.add(thetime, common.analyser.Content.TEXT)
           opinion = c['like_count']
           profile.content.append(common.analyser.Content(common.analyser.Content.TEXT,c['message'],thetime,None,None,opinion))
           if 'attachment' in c:
@@ -150,7 +150,9 @@ if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Analyse Facebook profiles.',fromfile_prefix_chars='@')
   parser.add_argument('database', help='A CSV ProfileStore to analyse downloaded profiles from')
   parser.add_argument('--verbose','-v', help='Give more output than usual.', action='count')
+  parser.add_argument('--shared', help='Allow other processes to write to the database at the same time.', action='store_true')
   parser.add_argument('--names','-n', help='Specify file to store name output in.', default='name_terms.txt')
+  parser.add_argument('--redo', help='Analyse every downloaded profile again, including those analysed before.', action='store_true')
   args = parser.parse_args()
 
   logger = None
@@ -161,11 +163,11 @@ if __name__ == '__main__':
     logger = common.logger.getLogger('facebookanalyser',output='facebook.log')
   logger.info('Logger initialised')
 
-  ps = common.profilestore.ProfileStore(args.database,logger=logger)
+  ps = common.profilestore.open_store(args.database,logger=logger,shared=args.shared)
   logger.info('Using database \'{}\''.format(args.database))
   fbanalyser = FacebookAnalyser(ps, logger=logger, namesfile=args.names)
   prefix = args.database[:-7]
-  fbanalyser.run(prefix+'-raw',prefix+'-profiles')
+  fbanalyser.run(prefix+'-raw',prefix+'-profiles',redo=args.redo)
 
 
 
@@ -1,5 +1,4 @@
 import argparse
-import time
 
 try:
   import common.connect
@@ -14,6 +13,11 @@ except ImportError as ie:
 class FacebookConnection(common.connect.JSONConnection):
 
   delay = 4
+  #Graph API error codes for rate limiting, which Facebook reports in
+  #the body of a 400 or 403 response rather than with a 429.
+  rate_limit_codes = (4, 17, 32, 613)
+  backoff = 60
+  max_backoff = 3600
 
   def __init__(self,app_token,user_token,logger):
     self.app_token = app_token
@@ -21,20 +25,12 @@ class FacebookConnection(common.connect.JSONConnection):
     super().__init__(logger)
 
   def handle_error(self, error_obj):
-    self.logger.warn(error_obj)
-    if hasattr(error_obj, 'code'):
-      self.logger.info(error_obj.code)
-      if error_obj.code == 400:
-        self.logger.warn("Facebook is denying access. Writing blockfile and waiting for human intervention.")
-        fw = open('blockfile','w')
-        fw.write('NO')
-        fw.close()
-        while True:
-          stat = open('blockfile').read()
-          if stat == 'OK':
-            break
-          time.sleep(5)
-      
+    super().handle_error(error_obj)
+    error = (self.error_json(error_obj) or {}).get('error')
+    if isinstance(error, dict) and error.get('code') in self.rate_limit_codes:
+      self.logger.warn("Facebook is rate limiting requests. Slowing Facebook requests.")
+      self.throttle.throttled()
+
 
   def build_request(self,url,params):
     if 'as_user' in params:
@@ -49,6 +49,7 @@ if __name__ == '__main__':
   parser.add_argument('--key','-k', help='The access token for the app to query the Facebook API')
   parser.add_argument('--db', help='A CSV file to use as a running profile database.')
   parser.add_argument('--verbose','-v', help='Give more output than usual.', action='count')
+  parser.add_argument('--shared', help='Allow other processes to write to the database at the same time.', action='store_true')
   args = parser.parse_args()
 
   if not args.key:
@@ -65,7 +66,7 @@ if __name__ == '__main__':
   fbconn = PooledConnection(args.key, FacebookConnection, logger=logger)
   if args.db:
     logger.info('Using database \'{}\''.format(args.db))
-    ps = common.profilestore.ProfileStore(args.db.strip(),logger=logger)
+    ps = common.profilestore.open_store(args.db.strip(),logger=logger,shared=args.shared)
     fbsearch = FacebookSearch(connection=fbconn,profilestore=ps,logger=logger)
   else:
     fbsearch = FacebookSearch(connection=fbconn,logger=logger)
@@ -13,6 +13,7 @@ except ImportError as ie:
 
 import common.profilestore
 import common.analyser
+import common.timeline
 
 class GplusAnalyser(common.analyser.Analyser):
   
@@ -114,7 +115,6 @@ class GplusAnalyser(common.analyser.Analyser):
             self._analyse_main(ao['actor'], 
                                common.analyser.Profile(ao['actor']['id'], self.network_name, profile.uid)))
         thetime = time.strptime(a['published'][:19],self.datestring)
-        profile.activity_timestamps.append(thetime)
         #location seems to be doubly encoded
         loc = None
         if 'geocode' in a:
@@ -123,9 +123,9 @@ class GplusAnalyser(common.analyser.Analyser):
           pos = a['location']['position']
           loc = common.analyser.Location([pos['longitude'],pos['latitude']],True)
 
+        #if we get a location we can tie it to the time.
+        profile.timeline.add(thetime, common.timeline.Timeline.ACTIVITY, loc)
         if loc != None:
-          #if we get a location we can tie to a time...
-          profile.location_history.append({thetime:loc})
           profile.location_set.append(loc)
 
         #two options for opinion measures
@@ -171,7 +171,7 @@ class GplusAnalyser(common.analyser.Analyser):
                              common.analyser.Profile(c['actor']['id'], self.network_name, profile.uid)))
       else:
         thetime = time.strptime(c['published'][:19],self.datestring)
-        profile.activity_timestamps.append(thetime)
+        profile.timeline.add(thetime, common.analyser.Content.TEXT)
 
         if 'object' in c:
           text = None
@@ -217,7 +217,9 @@ if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Analyse Google+ profiles.',fromfile_prefix_chars='@')
   parser.add_argument('database', help='A CSV ProfileStore to analyse downloaded profiles from')
   parser.add_argument('--verbose','-v', help='Give more output than usual.', action='count')
+  parser.add_argument('--shared', help='Allow other processes to write to the database at the same time.', action='store_true')
   parser.add_argument('--names','-n', help='Specify file to store name output in.', default='name_terms.txt')
+  parser.add_argument('--redo', help='Analyse every downloaded profile again, including those analysed before.', action='store_true')
   args = parser.parse_args()
 
   logger = None
@@ -228,11 +230,11 @@ if __name__ == '__main__':
     logger = common.logger.getLogger('gplusanalyser',output='gplus.log')
   logger.info('Logger initialised')
 
-  ps = common.profilestore.ProfileStore(args.database,logger=logger)
+  ps = common.profilestore.open_store(args.database,logger=logger,shared=args.shared)
   logger.info('Using database \'{}\''.format(args.database))
   runname = args.database[:-7]
   gpanalyser = GplusAnalyser(ps, logger=logger, namesfile=args.names)
-  gpanalyser.run(indirpath=runname+'-raw',outdirpath=runname+'-profiles')
+  gpanalyser.run(indirpath=runname+'-raw',outdirpath=runname+'-profiles',redo=args.redo)
 
 
 
@@ -7,6 +7,10 @@ class GoogleConnection(common.connect.JSONConnection):
   
   delay = 0.2
   waitseconds = 86400
+  #Error reasons meaning the API key itself was refused, rather than
+  #the request; Google reports these with a 400 or 403.
+  key_error_reasons = ('keyInvalid', 'keyExpired', 'accessNotConfigured', 'ipRefererBlocked',
+                       'API_KEY_INVALID', 'API_KEY_EXPIRED', 'SERVICE_DISABLED', 'API_KEY_SERVICE_BLOCKED')
 
   def __init__(self, server_key, logger=None):
     self.server_key = server_key
@@ -16,7 +20,19 @@ class GoogleConnection(common.connect.JSONConnection):
     params['key'] = self.server_key
     return super().build_request(url,params)
 
+  def error_reasons(self, error_obj):
+    """ Return the reasons given in a Google API error response. """
+    error = (self.error_json(error_obj) or {}).get('error')
+    if not isinstance(error, dict):
+      return set()
+    return {e.get('reason') for e in error.get('errors', []) + error.get('details', []) if isinstance(e, dict)}
+
   def handle_error(self, error_obj):
     super().handle_error(error_obj)
-    if hasattr(error_obj, 'code') and error_obj.code and error_obj.code == 403:
+    if getattr(error_obj, 'code', None) not in (400, 403):
+      return
+    if self.error_reasons(error_obj) & set(self.key_error_reasons):
+      #Counted as an authentication error, so a pool quarantines the key.
+      self.autherrors += 1
+    elif error_obj.code == 403:
       self.flag_wait() 
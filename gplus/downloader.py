@@ -13,6 +13,7 @@ except ImportError as ie:
 from gplus.connect import GoogleConnection
 from common.connect import PooledConnection
 
+import common.connect
 import common.downloader
 import common.profilestore
 
@@ -23,24 +24,24 @@ class GplusDownloader(common.downloader.Downloader):
   activity_api = 'https://www.googleapis.com/plus/v1/activities/'
 
   def download(self, record):
-    results = []
+    #Responses are not kept here, so that in streaming mode only the
+    #activity list need be held in memory.
     n_id = record['network_id']
-    results.append(self.get_bundled(self.people_api+n_id, {}))
-    results.append(self.get_bundled(self.people_api+n_id+'/activities/public', {}))
-    if results[1] and 'items' in results[1]:
-      for activity in results[1]['items']:
+    self.get_bundled(self.people_api+n_id, {})
+    activities = self.get_bundled(self.people_api+n_id+'/activities/public', {})
+    if activities and 'items' in activities:
+      for activity in activities['items']:
         if 'id' in activity:
           a_id = activity['id']
           if 'object' in activity:
             params = {'maxResults':100}
             ao = activity['object']
             if 'replies' in ao and ao['replies']['totalItems'] > 0:
-              results.append(self.get_bundled(self.activity_api+a_id+'/comments', params))
+              self.get_bundled(self.activity_api+a_id+'/comments', params)
             if 'plusoners' in ao and ao['plusoners']['totalItems'] > 0:
-              results.append(self.get_bundled(self.activity_api+a_id+'/plusoners', params))
+              self.get_bundled(self.activity_api+a_id+'/plusoners', params)
             if 'resharers' in ao and ao['resharers']['totalItems'] > 0:
-              results.append(self.get_bundled(self.activity_api+a_id+'/resharers', params))
-    return results
+              self.get_bundled(self.activity_api+a_id+'/resharers', params)
           
     
 
@@ -49,6 +50,13 @@ if __name__ == '__main__':
   parser.add_argument('database', help='A CSV ProfileStore to download profiles from')
   parser.add_argument('--key','-k',help='The API keys file for Google+.')
   parser.add_argument('--verbose','-v', help='Give more output than usual.', action='count')
+  parser.add_argument('--workers','-w', type=int, default=1, help='The number of profiles to download at once (at most one per key).')
+  parser.add_argument('--asyncio', help='Make requests from an asyncio event loop, so keys waiting out a rate limit do not hold up the others.', action='store_true')
+  parser.add_argument('--streaming', help='Write responses to disk as they arrive, resuming interrupted profiles.', action='store_true')
+  parser.add_argument('--cache', help='A directory in which to cache API responses, so that repeated queries are not re-sent.')
+  parser.add_argument('--cassette', help='A file to record API responses to, and replay them from.')
+  parser.add_argument('--server', help='Send API requests to this base url (e.g. a common.fakeserver) instead.')
+  parser.add_argument('--shared', help='Allow other processes to write to the database at the same time.', action='store_true')
   args = parser.parse_args()
 
   if not args.key:
@@ -61,10 +69,21 @@ if __name__ == '__main__':
   else:
     logger = common.logger.getLogger('gplusdownloader',output='gplus.log')
   logger.info('Logger initialised')
+  if args.cache:
+    common.connect.use_cache(args.cache, logger=logger)
+  if args.server:
+    common.connect.use_server(args.server)
+  if args.cassette:
+    common.connect.use_cassette(args.cassette, logger=logger)
 
   gplusconn = PooledConnection(args.key, GoogleConnection, logger=logger)
-  ps = common.profilestore.ProfileStore(args.database,logger=logger)
+  ps = common.profilestore.open_store(args.database,logger=logger,shared=args.shared)
   runname = args.database.split('.')[0]
   logger.info('Using database \'{}\''.format(args.database))
   gpdownloader = GplusDownloader(ps, gplusconn,logger=logger)
-  gpdownloader.run(dirpath=runname+'-raw')
+  if args.asyncio:
+    gpdownloader.run_async(dirpath=runname+'-raw', concurrency=args.workers, streaming=args.streaming)
+  else:
+    gpdownloader.run(dirpath=runname+'-raw', workers=args.workers, streaming=args.streaming)
+  if args.cache:
+    logger.info('Response cache: {}'.format(common.connect.MediaConnection.cache.stats()))
@@ -46,7 +46,7 @@ class LinkedInAnalyser(common.analyser.Analyser):
         if 'startDate' in pos and 'year' in pos['startDate']:
           day = pos['startDate']['day'] if 'day' in pos['startDate'] else 1
           month = pos['startDate']['month'] if 'month' in pos['startDate'] else 1
-          profile.activity_timestamps.append(datetime.date(pos['startDate']['year'],month,day).timetuple())
+          profile.timeline.add(datetime.date(pos['startDate']['year'],month,day).timetuple())
 
     if 'location' in result:
       loc = common.analyser.Location(result['location']['name'])
@@ -74,7 +74,7 @@ class LinkedInAnalyser(common.analyser.Analyser):
       sh = result['currentShare']
       #convert timestamp format.
       timestamp = datetime.datetime.fromtimestamp(result['currentShare']['timestamp']/1000)
-      profile.activity_timestamps.append(timestamp.timetuple())
+      profile.timeline.add(timestamp.timetuple())
       profile.last_seen = timestamp
       category = None
       if 'industry' in result:
@@ -109,7 +109,9 @@ if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Analyse LinkedIn profiles.',fromfile_prefix_chars='@')
   parser.add_argument('database', help='A CSV ProfileStore to analyse downloaded profiles from')
   parser.add_argument('--verbose','-v', help='Give more output than usual.', action='count')
+  parser.add_argument('--shared', help='Allow other processes to write to the database at the same time.', action='store_true')
   parser.add_argument('--names','-n', help='Specify file to store name output in.', default='name_terms.txt')
+  parser.add_argument('--redo', help='Analyse every downloaded profile again, including those analysed before.', action='store_true')
   args = parser.parse_args()
 
   logger = None
@@ -120,10 +122,10 @@ if __name__ == '__main__':
     logger = common.logger.getLogger('linkedinanalyser',output='linkedin.log')
   logger.info('Logger initialised')
 
-  ps = common.profilestore.ProfileStore(args.database,logger=logger)
+  ps = common.profilestore.open_store(args.database,logger=logger,shared=args.shared)
   logger.info('Using database \'{}\''.format(args.database))
   lianalyser = LinkedInAnalyser(ps, logger=logger, namesfile=args.names)
-  lianalyser.run()
+  lianalyser.run(redo=args.redo)
 
 
 
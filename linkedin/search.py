@@ -79,6 +79,7 @@ if __name__ == '__main__':
   parser.add_argument('--file','-f', help='A file containing search terms on each line.') 
   parser.add_argument('--db', help='A CSV file to use as a running profile database.')
   parser.add_argument('--verbose','-v', help='Give more output than usual.', action='count')
+  parser.add_argument('--shared', help='Allow other processes to write to the database at the same time.', action='store_true')
   args = parser.parse_args()
 
   logger = None
@@ -91,7 +92,7 @@ if __name__ == '__main__':
 
   if args.db:
     logger.info('Using database \'{}\''.format(args.db))
-    ps = common.profilestore.ProfileStore(args.db.strip(),logger=logger)
+    ps = common.profilestore.open_store(args.db.strip(),logger=logger,shared=args.shared)
     lisearch = LinkedInSearch(profilestore=ps,logger=logger)
   else:
     lisearch = LinkedInSearch(logger=logger)
@@ -32,9 +32,8 @@ def merge(runnames, outname):
           dup_count += 1
         recount = tmp
         shutil.copyfile(srcdir+os.sep+fname, dstdir+os.sep+fname)
-    for fromuid in ps.matches:
-      for touid in ps.matches[fromuid]:
-        dstps.add_match((iterum+int(fromuid)), (iterum+int(touid)))
+    for fromuid, touid in ps.pairs():
+      dstps.add_match((iterum+int(fromuid)), (iterum+int(touid)))
   print('Total of {} records copied. {} duplicates were discarded. {} records had no corresponding file.'.format(dstps.curuid, dup_count, missing_count))
 
 
@@ -2,6 +2,7 @@ import argparse
 import common.profilestore
 import common.logger
 import common.connect
+import common.analysisdriver
 
 import gplus.search
 import twitter.search
@@ -32,6 +33,10 @@ parser.add_argument('--gk', help='The keyfile containing one or more Google+ acc
 parser.add_argument('--fk', help='The keyfile containing one or more Facebook access keys.')
 parser.add_argument('--tk', help='The keyfile containing one or more Twitter access key sets.')
 parser.add_argument('--lk', help='The keyfile containing one or more LinkedIn access key sets.')
+parser.add_argument('--cache', help='A directory in which to cache API responses, so that repeated queries are not re-sent.')
+parser.add_argument('--workers', type=int, default=1, help='The number of profiles to download at once from each network (at most one per key).')
+parser.add_argument('--processes', type=int, default=None, help='The number of processes to analyse profiles with (default: one per CPU).')
+parser.add_argument('--redo', help='Analyse every downloaded profile again, including those analysed before.', action='store_true')
 
 args = parser.parse_args()
 
@@ -39,7 +44,10 @@ logger = common.logger.getLogger('oneshot', output=args.run_name+'.log', level='
 
 db_file = args.run_name+'-db.csv'
 logger.info('Database is {}'.format(db_file))
-profilestore = common.profilestore.ProfileStore(db_file, logger)
+profilestore = common.profilestore.open_store(db_file, logger)
+
+if args.cache:
+  common.connect.use_cache(args.cache, logger=logger)
 
 gpconn = None
 fbconn = None
@@ -87,7 +95,10 @@ for s in searchers:
   s.search_all(args.namesfile)
 
 for d in downers:
-  d.run(dirpath=raw_dir)
+  d.run(dirpath=raw_dir, workers=args.workers)
+
+driver = common.analysisdriver.AnalysisDriver(profilestore, analysers, logger, workers=args.processes)
+driver.run(indirpath=raw_dir, outdirpath=prof_dir, redo=args.redo)
 
-for a in analysers:
-  a.run(indirpath=raw_dir, outdirpath=prof_dir)
+if args.cache:
+  logger.info('Response cache: {}'.format(common.connect.MediaConnection.cache.stats()))
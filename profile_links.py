@@ -12,20 +12,19 @@ if __name__ == '__main__':
 
   logger = common.logger.getLogger('link-extractor',output='link.log',level='info')
 
-  ps = common.profilestore.ProfileStore(args.db,logger=logger)
+  ps = common.profilestore.open_store(args.db,logger=logger,lazy=True)
   
   dirname = args.db[:-7].replace('-','')
   profdir = dirname+'-profiles'
   linksfile = dirname+'-links.txt'
   lfh = open(linksfile,'w')
 
-  for record in ps.records:
-    if record['network'] == 'Google+':
-      fname = profdir+os.sep+record['uid']+'.pickle'
-      try:
-        p = pickle.load(open(fname,'rb'))
-        for l in p.profile_links:
-          lfh.write("{}\n".format(l))
-      except Exception as e:
-        print(e)
+  for record in ps.by_network('Google+'):
+    fname = profdir+os.sep+record['uid']+'.pickle'
+    try:
+      p = pickle.load(open(fname,'rb'))
+      for l in p.profile_links:
+        lfh.write("{}\n".format(l))
+    except Exception as e:
+      print(e)
     
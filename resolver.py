@@ -1,5 +1,6 @@
 import common.analyser
 import common.profilestore
+import common.bktree
 import itertools
 import math
 import logging
@@ -8,6 +9,11 @@ import editdistance
 import pickle
 import os
 
+#Bits in which the avatar hashes of unrelated images typically differ,
+#and within which two avatars are taken to be the same image.
+avatar_unrelated_bits = 32
+avatar_match_bits = 10
+
 def makeposterior(evidence_given_matched, prior, marginal_likelihood):
     """ Calculates an update to a prior, with some generous error
     handling for potentially terrible input. 
@@ -114,21 +120,37 @@ def timeComparison(profileone, profiletwo):
 def avatarComparison(profileone, profiletwo):
     """ Use an image comparison approach to compare the
         profile images from the two profiles, confidence
-        being the degree of similarity. Uses rms similarity
-        between actual pixel value, so fairly confusable."""
-    import operator
-    from functools import reduce
-    totaldiff=906 #adjusted based on observation
-#    totaldiff=453
-    h1 = profileone.getImageHistogram()
-    h2 = profiletwo.getImageHistogram()
-    if not h1 or not h2:
-      return 0
-    rms = math.sqrt(reduce(operator.add,  list(map(lambda a,b: (a-b)**2, h1, h2)))/len(h1) )
-    if rms > totaldiff:
-      logging.warn("Heuristic on avatar comparison error is wrong.")
+        being the degree of similarity. Compares perceptual
+        hashes (dHash), so resized or recompressed copies of
+        an avatar still match closely."""
+    h1 = profileone.getImageHash()
+    h2 = profiletwo.getImageHash()
+    if h1 is None or h2 is None:
       return 0
-    return 1-(rms/totaldiff)
+    #Unrelated images differ in about half of the 64 bits.
+    return max(0, 1-(common.bktree.hamming(h1, h2)/avatar_unrelated_bits))
+
+
+def avatarMatches(profiles, radius=avatar_match_bits):
+    """ Find the pairs of profiles on different networks whose
+        avatars are near-identical, using a BK-tree of their
+        perceptual hashes rather than comparing every pair.
+
+    :return: A list of (distance, profile, profile) tuples."""
+    tree = common.bktree.BKTree()
+    for profile in profiles:
+      h = profile.getImageHash()
+      if h is not None:
+        tree.add(h, profile)
+    matches = []
+    for profile in profiles:
+      h = profile.getImageHash()
+      if h is None:
+        continue
+      for distance, _, other in tree.search(h, radius):
+        if other.network != profile.network and (profile.network, str(profile.uid)) < (other.network, str(other.uid)):
+          matches.append((distance, profile, other))
+    return matches
 
 
 def stylometricComparison(profileone, profiletwo):
@@ -228,10 +250,11 @@ def resolve(profiles):
 
 parser = argparse.ArgumentParser(description='Attempt to match profiles based on content')
 parser.add_argument('db', help='The database file governing downloads')
+parser.add_argument('--avatars', help='Also list profiles on different networks with near-identical avatars, across all blocks.', action='store_true')
 args = parser.parse_args()
 
 block_struct = {}
-ps = common.profilestore.ProfileStore(args.db)
+ps = common.profilestore.open_store(args.db,lazy=True)
 prefix = args.db[:-7]
 print(prefix)
 pfdir = prefix+'-profiles/'
@@ -266,3 +289,11 @@ for bid in good_bids:
         wf.write("{},".format(sl))
     wf.write("{}\n".format(bid.replace(',',' ')))
 wf.close()
+
+if args.avatars:
+  wf = open(prefix+'-avatars.csv','w')
+  wf.write('origin.id,target.id,origin.network,target.network,distance,outcome\n')
+  allprofiles = [profile for block in block_struct.values() for profile in block]
+  for distance, pone, ptwo in avatarMatches(allprofiles):
+    wf.write('{},{},{},{},{},{}\n'.format(pone.rid, ptwo.rid, pone.network, ptwo.network, distance, 1 if ps.is_match(pone.rid,ptwo.rid) else 0))
+  wf.close()
@@ -27,7 +27,7 @@ if __name__ == '__main__':
 
   logger = common.logger.getLogger('measures-extractor',output='measures.log',level='info')
 
-  ps = common.profilestore.ProfileStore(args.db,logger=logger)
+  ps = common.profilestore.open_store(args.db,logger=logger,lazy=True)
   
   dirname = args.db[:-7].replace('-','')
   profdir = dirname+'-profiles'
@@ -48,14 +48,7 @@ if __name__ == '__main__':
         print("File Not Found: {}".format(fname))
         continue
       name = p.bestname() 
-      matched = 0
-      if record['uid'] in ps.matches:
-        matched = 1
-      else:
-        for m in ps.matches:
-          if record['uid'] in ps.matches[m]:
-            matched = 1
-            break
+      matched = 1 if ps.is_matched(record['uid']) else 0
       if name:
         name = name.replace(',',' ')
       occ = p.occupation
@@ -3,6 +3,7 @@ import argparse
 import common.sampler
 import common.logger
 import common.connect
+import common.analysisdriver
 
 import gplus.connect
 import facebook.connect
@@ -32,6 +33,10 @@ parser.add_argument('--gk', help='The keyfile containing one or more Google+ acc
 parser.add_argument('--fk', help='The keyfile containing one or more Facebook access keys.')
 parser.add_argument('--tk', help='The keyfile containing one or more Twitter access key sets.')
 parser.add_argument('--lk', help='The keyfile containing one or more LinkedIn access key sets.')
+parser.add_argument('--workers', type=int, default=1, help='The number of profiles to download at once from each network (at most one per key).')
+parser.add_argument('--processes', type=int, default=None, help='The number of processes to analyse profiles with (default: one per CPU).')
+parser.add_argument('--cache', help='A directory in which to cache API responses, so that repeated queries are not re-sent.')
+parser.add_argument('--redo', help='Analyse every downloaded profile again, including those analysed before.', action='store_true')
 parser
 
 args = parser.parse_args()
@@ -42,6 +47,8 @@ logger = common.logger.getLogger('sampling-tool', output=args.run_name+'.log', l
 logger.info('Logger initialised.')
 
 #Prime connection handlers.
+if args.cache:
+  common.connect.use_cache(args.cache, logger=logger)
 gpconn = None
 fbconn = None
 twconn = None
@@ -67,7 +74,7 @@ common.sampler.sample(common.sampler.datafile, sample_file, common.sampler.maxle
 #Initialise centralised store
 db_file = args.run_name+'-db.csv'
 logger.info('Database is {}'.format(db_file))
-profilestore = common.profilestore.ProfileStore(db_file, logger)
+profilestore = common.profilestore.open_store(db_file, logger)
 
 # Initialise Google+ search handler
 gplussearch = gplus.search.GPlusSearch(gpconn, profilestore, logger)
@@ -79,12 +86,12 @@ gplussearch.search_all(sample_file)
 raw_dir = args.run_name+'-raw'
 profile_dir = args.run_name+'-profiles'
 gplusdown = gplus.downloader.GplusDownloader(profilestore, gpconn, logger)
-gplusdown.run(dirpath=raw_dir)
+gplusdown.run(dirpath=raw_dir, workers=args.workers)
 
 #Analyse the downloaded profiles, pulling out matches and names for negative example sampling.
 namesfile = args.run_name+'-names.txt'
 gplusanal = gplus.analyser.GplusAnalyser(profilestore, logger=logger, namesfile=namesfile)
-gplusanal.run(indirpath=raw_dir, outdirpath=profile_dir)
+common.analysisdriver.AnalysisDriver(profilestore, [gplusanal], logger, workers=args.processes).run(indirpath=raw_dir, outdirpath=profile_dir, redo=args.redo)
 
 #Now do searches to get negative examples and download all data.
 if twconn:
@@ -94,10 +101,10 @@ if twconn:
   twsearch.search_all(namesfile)
   #Download
   twdown = twitter.downloader.TwitterDownloader(profilestore, twconn, logger)
-  twdown.run(dirpath=raw_dir)
+  twdown.run(dirpath=raw_dir, workers=args.workers)
   #Analyse
   twanal = twitter.analyser.TwitterAnalyser(profilestore, logger=logger)
-  twanal.run(indirpath=raw_dir, outdirpath=profile_dir)
+  common.analysisdriver.AnalysisDriver(profilestore, [twanal], logger, workers=args.processes).run(indirpath=raw_dir, outdirpath=profile_dir, redo=args.redo)
 
 if fbconn:
   logger.info("Running Facebook Negative Search.")
@@ -106,10 +113,10 @@ if fbconn:
   fbsearch.search_all(namesfile)
   #Download
   fbdown = facebook.downloader.FacebookDownloader(profilestore, fbconn, logger)
-  fbdown.run(dirpath=raw_dir)
+  fbdown.run(dirpath=raw_dir, workers=args.workers)
   #Analyse
   fbanal = facebook.analyser.FacebookAnalyser(profilestore, logger=logger)
-  fbanal.run(indirpath=raw_dir, outdirpath=profile_dir)
+  common.analysisdriver.AnalysisDriver(profilestore, [fbanal], logger, workers=args.processes).run(indirpath=raw_dir, outdirpath=profile_dir, redo=args.redo)
 
 if liconn:
   logger.info("Running LinkedIn Negative Search.")
@@ -118,11 +125,10 @@ if liconn:
   lisearch.search_all(namesfile)
 #  #Download
   lidown = linkedin.downloader.LinkedInDownloader(profilestore, liconn, logger)
-  lidown.run(dirpath=raw_dir)
+  lidown.run(dirpath=raw_dir, workers=args.workers)
 #  #Analyse
   lianal = linkedin.analyser.LinkedInAnalyser(profilestore, logger=logger)
-  lianal.run(indirpath=raw_dir, outdirpath=profile_dir)
-
-
-
+  common.analysisdriver.AnalysisDriver(profilestore, [lianal], logger, workers=args.processes).run(indirpath=raw_dir, outdirpath=profile_dir, redo=args.redo)
 
+if args.cache:
+  logger.info('Response cache: {}'.format(common.connect.MediaConnection.cache.stats()))
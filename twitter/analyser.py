@@ -69,9 +69,9 @@ class TwitterAnalyser(common.analyser.Analyser):
           category = [ht['text'] for ht in se['hashtags']]  
 
       #handle time
+      statustime = None
       if 'created_at' in status:
         statustime = time.strptime(status['created_at'],self.datestring)
-        profile.activity_timestamps.append(statustime)
 
       #handle location
       location = None
@@ -81,8 +81,9 @@ class TwitterAnalyser(common.analyser.Analyser):
       elif 'place' in status and status['place']:
         location = common.analyser.Location(status['place'])
       if location:
-        profile.location_history.append({statustime:location})
         profile.location_set.append(location)
+      if statustime:
+        profile.timeline.add(statustime, common.analyser.Content.TEXT, location)
 
       #handle opinions
       opinions = {}
@@ -140,7 +141,9 @@ if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Analyse Twitter profiles.',fromfile_prefix_chars='@')
   parser.add_argument('database', help='A CSV ProfileStore to analyse downloaded profiles from')
   parser.add_argument('--verbose','-v', help='Give more output than usual.', action='count')
+  parser.add_argument('--shared', help='Allow other processes to write to the database at the same time.', action='store_true')
   parser.add_argument('--names','-n', help='Specify file to store name output in.', default='name_terms.txt')
+  parser.add_argument('--redo', help='Analyse every downloaded profile again, including those analysed before.', action='store_true')
   args = parser.parse_args()
 
   logger = None
@@ -151,11 +154,11 @@ if __name__ == '__main__':
     logger = common.logger.getLogger('twitteranalyser',output='twitter.log')
   logger.info('Logger initialised')
 
-  ps = common.profilestore.ProfileStore(args.database,logger=logger)
+  ps = common.profilestore.open_store(args.database,logger=logger,shared=args.shared)
   logger.info('Using database \'{}\''.format(args.database))
   twanalyser = TwitterAnalyser(ps, logger=logger, namesfile=args.names)
   basename = args.database[:-7]
-  twanalyser.run(indirpath=basename+'-raw', outdirpath=basename+'-profiles')
+  twanalyser.run(indirpath=basename+'-raw', outdirpath=basename+'-profiles', redo=args.redo)
 
 
         
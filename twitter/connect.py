@@ -8,6 +8,13 @@ import common.connect
 class TwitterConnection(common.connect.JSONOauthConnection):
 
   waitseconds = 900
+  #Per-user limits for each 15-minute window.
+  quotas = {'/users/show': (900, 900),
+            '/users/search': (900, 900),
+            '/users/contributors': (900, 900),
+            '/statuses/user_timeline': (900, 900),
+            '/friends/list': (15, 900),
+            '/followers/list': (15, 900)}
   
   def handle_response(self, response_text, head):
       ret = super().handle_response(response_text, head)
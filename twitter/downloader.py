@@ -12,6 +12,7 @@ except ImportError as ie:
 
 from twitter.connect import TwitterConnection
 
+import common.connect
 import common.downloader
 import common.profilestore
 from urllib.parse import quote_plus
@@ -51,6 +52,12 @@ if __name__ == '__main__':
   parser.add_argument('database', help='A CSV ProfileStore to download profiles from')
   parser.add_argument('--key','-k',help='The credentials file with consumer key, consumer secret, user token and user secret for Twitter API authentication, in that order per line.')
   parser.add_argument('--verbose','-v', help='Give more output than usual.', action='count')
+  parser.add_argument('--workers','-w', type=int, default=1, help='The number of profiles to download at once (at most one per key).')
+  parser.add_argument('--asyncio', help='Make requests from an asyncio event loop, so keys waiting out a rate limit do not hold up the others.', action='store_true')
+  parser.add_argument('--cache', help='A directory in which to cache API responses, so that repeated queries are not re-sent.')
+  parser.add_argument('--cassette', help='A file to record API responses to, and replay them from.')
+  parser.add_argument('--server', help='Send API requests to this base url (e.g. a common.fakeserver) instead.')
+  parser.add_argument('--shared', help='Allow other processes to write to the database at the same time.', action='store_true')
   args = parser.parse_args()
 
   if not args.key or len(args.key) < 4:
@@ -63,11 +70,20 @@ if __name__ == '__main__':
   else:
     logger = common.logger.getLogger('twitterdownloader',output='twitter.log')
   logger.info('Logger initialised')
+  if args.cache:
+    common.connect.use_cache(args.cache, logger=logger)
+  if args.server:
+    common.connect.use_server(args.server)
+  if args.cassette:
+    common.connect.use_cassette(args.cassette, logger=logger)
 
   twitterconnpool = common.connect.PooledConnection(args.key,TwitterConnection,logger)
-  ps = common.profilestore.ProfileStore(args.database,logger=logger)
+  ps = common.profilestore.open_store(args.database,logger=logger,shared=args.shared)
   logger.info('Using database \'{}\''.format(args.database))
   twdownloader = TwitterDownloader(ps, twitterconnpool,logger=logger)
-  twdownloader.run()
-
-
+  if args.asyncio:
+    twdownloader.run_async(concurrency=args.workers)
+  else:
+    twdownloader.run(workers=args.workers)
+  if args.cache:
+    logger.info('Response cache: {}'.format(common.connect.MediaConnection.cache.stats()))
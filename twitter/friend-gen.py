@@ -22,10 +22,14 @@ if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Download Twitter profiles connected to the listed seed profiles.')
   parser.add_argument('infile', help='A file containing a list of twitter profile URLs')
   parser.add_argument('--key','-k',help='The credentials file with consumer key, consumer secret, user token and user secret for Twitter API authentication, in that order per line.')
+  parser.add_argument('--cache', help='A directory in which to cache API responses, so that re-runs do not re-send queries.')
+  parser.add_argument('--redo', help='Analyse every downloaded profile again, including those analysed before.', action='store_true')
   args = parser.parse_args()
 
 
   logger = common.logger.getLogger('twitterfriends',output='friend-gen.log',level='info')
+  if args.cache:
+    common.connect.use_cache(args.cache, logger=logger)
 
   #Build a seed database from the input file
   psfile = args.infile+'-seed.db'
@@ -52,7 +56,7 @@ if __name__ == '__main__':
 
   #Convert seed profiles into Profile objects.
   seedanalyser = twitter.analyser.TwitterAnalyser(ps, logger=logger)
-  seedanalyser.run(indirpath=srawdir,outdirpath=sprofdir)
+  seedanalyser.run(indirpath=srawdir,outdirpath=sprofdir,redo=args.redo)
 
   #Build a profilestore of friends
   rpsfile = args.infile+'-results.db' 
@@ -77,4 +81,6 @@ if __name__ == '__main__':
 
   #Farm results into profile form
   analyser = twitter.analyser.TwitterAnalyser(rps, logger=logger)
-  analyser.run(indirpath=rawdir, outdirpath=profdir)
+  analyser.run(indirpath=rawdir, outdirpath=profdir, redo=args.redo)
+  if args.cache:
+    logger.info('Response cache: {}'.format(common.connect.MediaConnection.cache.stats()))
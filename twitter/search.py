@@ -41,6 +41,7 @@ if __name__ == '__main__':
   parser.add_argument('--key','-k', nargs=4, help='The consumer key, consumer secret, user token and user secret for Twitter API authentication, in that order.')
   parser.add_argument('--db', help='A CSV file to use as a running profile database.')
   parser.add_argument('--verbose','-v', help='Give more output than usual.', action='count')
+  parser.add_argument('--shared', help='Allow other processes to write to the database at the same time.', action='store_true')
   args = parser.parse_args()
 
   if not args.key or len(args.key) < 4:
@@ -57,7 +58,7 @@ if __name__ == '__main__':
   twconn = TwitterConnection(*args.key,logger=logger)
   if args.db:
     logger.info('Using database \'{}\''.format(args.db))
-    ps = common.profilestore.ProfileStore(args.db.strip(),logger=logger)
+    ps = common.profilestore.open_store(args.db.strip(),logger=logger,shared=args.shared)
     twsearch = TwitterSearch(twconn,profilestore=ps,logger=logger)
   else:
     twsearch = TwitterSearch(twconn,logger=logger)